@@ -1,28 +1,57 @@
 from dolfin import * # Only here to give pyipopt the correct petsc_comm_world
 import numpy
 import pyipopt
-import sympy
+from cable_constraints import (CableConstraints, pair_distances,
+                               candidate_pairs)
 
 
 class MultiCableOptimization():
     
-    def __init__(self, num_cables, cable_scales, J, dJ):      
+    def __init__(self, num_cables, cable_scales, J, dJ, active_set=False,
+                 margin=0.1):
+        """
+        Ipopt optimization of the cable positions.
+        If active_set is True, Ipopt only gets the non-collision constraints
+        of pairs closer than their minimal distance plus margin. After each
+        Ipopt solve, the pairs are recomputed at the solution, and the
+        problem is solved again with the new pairs added, until no new
+        pair is within the margin. Ipopt options that should persist
+        when the problem is recreated must be set with int_option,
+        num_option and str_option.
+        """
         self.g_scale = 1 # Scaling of coefficient for gradient constraint
-        self.outer_radius = 1.2 # Radius of background cable
-        self.inner_radius = 0.3 # Radius for each inner cable
-        self.distance_from_outer = 0.05 # Distance for each cable to outer boundary
-        self.distance_from_internal = 0.025 # Distance between each internal cable
         self.num_cables = num_cables
-        self.inner_radius *= cable_scales
-        self.max_radius = self.outer_radius - self.inner_radius\
-                          - self.distance_from_outer
-        self.sympy_g(self.num_cables)
-        self.sympy_jac_g()
+        (self.inner_radius, self.max_radius,
+         self.min_distance) = self.layout_bounds(cable_scales)
+        self.active_set = active_set
+        self.margin = margin
+        self.int_options, self.num_options, self.str_options = {}, {}, {}
+        self.intermediate = None
+        self.J, self.dJ = J, dJ
+        self.nlp = None
+        self.result = None # Output of the last Ipopt solve
+        self.init_constraints()
         self.solve_init(J, dJ)
 
+    outer_radius = 1.2 # Radius of background cable
+    inner_radius = 0.3 # Radius for each inner cable
+    distance_from_outer = 0.05 # Distance for each cable to outer boundary
+    distance_from_internal = 0.025 # Distance between each internal cable
+
+    @classmethod
+    def layout_bounds(cls, cable_scales):
+        """
+        Radius of each cable, maximal distance of each cable center from
+        origo and minimal distance between the centers of each pair
+        """
+        inner_radius = cls.inner_radius*numpy.asarray(cable_scales)
+        max_radius = cls.outer_radius - inner_radius - cls.distance_from_outer
+        min_distance = pair_distances(inner_radius, cls.distance_from_internal)
+        return inner_radius, max_radius, min_distance
+
     def eval_g(self, x):
         """ Evaluate inequality constraint, g(x) <= 0, """
-        return self.replace_sympy_g(x)
+        return self.g_scale*self.constraints.g(x)
 
 
     def eval_jac_g(self, cable_positions, flag):
@@ -31,78 +60,58 @@ class MultiCableOptimization():
         flag = False means 'give me the Jacobian'.
         """
         if flag:
-            # FIXME: Pass in a dense matrix
-            # (could be optimised, but we don't care for this small problem).
-            nvar = len(cable_positions)
-            n_cables = int(nvar/2)
-            ncon = int(n_cables + n_cables*(n_cables-1)/2)
-            rows = []
-            for i in range(ncon):
-                rows += [i] * nvar
-            cols = list(range(nvar)) * ncon
-            return (numpy.array(rows), numpy.array(cols))
+            return self.constraints.jac_structure()
         else:
-            return self.replace_sympy_jac_g(cable_positions)
+            return self.g_scale*self.constraints.jac(cable_positions)
 
-    
-    def sympy_g(self, num_cables):
+    def init_constraints(self):
         """ Creates the maximum distance and no-collision constraint 
-        for each sub-cables with sympy, returning the g in inequality g<=0 and
-        an array z of the control variables
+        for each sub-cables
         """
-        x = list(sympy.symbols("x0:%d" % num_cables))
-        y = list(sympy.symbols("y0:%d" % num_cables))
-        g,z= [],[]
-        for i in range(num_cables):
-            g.append(x[i]**2 + y[i]**2 - self.max_radius[i]**2)
-        for i in range(num_cables):
-            z.append(x[i])
-            z.append(y[i])
-            for j in range(i+1,num_cables):
-                xi, yi = x[i], y[i]
-                xj, yj = x[j], y[j]
-                int_radius = self.inner_radius[i] + self.inner_radius[j]\
-                             + self.distance_from_internal
-                # FIXME: Max_int_radius should change with each cable radius
-                g.append(int_radius**2 - (xi - xj)**2 - (yi - yj)**2)
-        self.g = sympy.Matrix(g)
-        self.z = sympy.Matrix(z)
-    
-
-    def sympy_jac_g(self):
-        """ Creates jacobian for constraints """
-        self.jac_g = self.g.jacobian(self.z)
+        pairs = numpy.zeros((0, 2), dtype=int) if self.active_set else None
+        self.constraints = CableConstraints(self.max_radius, self.min_distance,
+                                            pairs=pairs)
 
+    def int_option(self, name, value):
+        """ Set integer Ipopt option, kept if the problem is recreated """
+        self.int_options[name] = value
+        self.nlp.int_option(name, value)
 
-    def replace_sympy_g(self, positions):
-        """ Create numpy array of constraint at current positions """
-        g_numpy = self.g.subs([(self.z[i], positions[i])
-                               for i in range(2*self.num_cables)])
-        return self.g_scale*numpy.array(g_numpy).astype(float)
+    def num_option(self, name, value):
+        """ Set numeric Ipopt option, kept if the problem is recreated """
+        self.num_options[name] = value
+        self.nlp.num_option(name, value)
 
+    def str_option(self, name, value):
+        """ Set string Ipopt option, kept if the problem is recreated """
+        self.str_options[name] = value
+        self.nlp.str_option(name, value)
 
-    def replace_sympy_jac_g(self, positions):
-        """ Create numpy array of jacobian of constraint at
-        current positions """    
-        numpy_jac_g = self.jac_g.subs([(self.z[i], positions[i])
-                                       for i in range(2*self.num_cables)])
-        return self.g_scale*numpy.array(numpy_jac_g).astype(float)
+    def set_intermediate_callback(self, callback):
+        """
+        Set the Ipopt intermediate callback, kept if the problem is
+        recreated. Ipopt stops if the callback returns False.
+        """
+        self.intermediate = callback
+        self.nlp.set_intermediate_callback(callback)
 
     def solve_init(self, eval_J, eval_dJ):
         nvar = int(2*self.num_cables)
-        ncon = int(self.num_cables + self.num_cables*(self.num_cables-1)/2)
+        ncon = self.constraints.num_constraints
         low_var = -numpy.inf*numpy.ones(nvar,dtype=float)
         up_var = numpy.inf*numpy.ones(nvar, dtype=float)
         up_var[0], low_var[0] = 0, 0
         inf_con = numpy.inf*numpy.ones(ncon, dtype=float)
         zero_con = numpy.zeros(ncon, dtype=float)
+        if self.nlp is not None:
+            self.nlp.close()
         self.nlp = pyipopt.create(nvar,      # Number of controls
                                   low_var,  # Lower bounds for Control
                                   up_var,   # Upper bounds for Control
                                   ncon,      # Number of constraints
                                   -inf_con,  # Lower bounds for contraints
                                   zero_con,   # Upper bounds for contraints
-                                  nvar*ncon, # Number of nonzeros in cons. Jac
+                                  self.constraints.num_nonzeros, # Nonzeros in cons. Jac
                                   0,         # Number of nonzeros in cons. Hes
                                   lambda pos: eval_J(pos),  # Objective eval
                                   lambda pos: eval_dJ(pos), # Obj. grad eval
@@ -112,6 +121,36 @@ class MultiCableOptimization():
          # So it does not violate the boundary constraint
         self.nlp.num_option('bound_relax_factor', 0)
         self.nlp.int_option('print_level', 6)
+        for name, value in self.int_options.items():
+            self.nlp.int_option(name, value)
+        for name, value in self.num_options.items():
+            self.nlp.num_option(name, value)
+        for name, value in self.str_options.items():
+            self.nlp.str_option(name, value)
+        if self.intermediate is not None:
+            self.nlp.set_intermediate_callback(self.intermediate)
 
     def solve(self, cable_positions):
-        return self.nlp.solve(cable_positions)[0]
+        if not self.active_set:
+            self.result = self.nlp.solve(cable_positions)
+            return self.result[0]
+        positions = numpy.array(cable_positions, dtype=float)
+        pairs = set()
+        rounds = 0
+        while True:
+            candidates = set(map(tuple, candidate_pairs(
+                positions, self.constraints.min_distance, self.margin)))
+            if len(candidates - pairs) == 0 and rounds > 0:
+                # All pairs within the margin were constrained
+                return positions
+            # Pairs are only added, such that the rounds terminate
+            pairs |= candidates
+            self.constraints.set_pairs(sorted(pairs))
+            self.solve_init(self.J, self.dJ)
+            # Reported with the Ipopt output, silenced with print_level 0
+            if self.int_options.get("print_level", 6) > 0:
+                print("Active set round %d: %d pair constraints"
+                      % (rounds, len(pairs)))
+            self.result = self.nlp.solve(positions)
+            positions = self.result[0]
+            rounds += 1
@@ -1,14 +1,30 @@
 from dolfin import *
+from collections import OrderedDict
 import numpy
+from profiler import profiler, BUILD, ASSEMBLE, LOCK, FACTORIZE, SOLVE,\
+    GRADIENT, IO, FORMS, UPDATE_MESH
 
 class MultiCable():
-    def __init__(self, scales, positions, lmb_core, lmb_iso, lmb_fill, fs):
+    def __init__(self, scales, positions, lmb_core, lmb_iso, lmb_fill, fs,
+                 krylov_tol=None):
+        """
+        Arguments:
+            scales     - Scale of each cable
+            positions  - Initial (x, y) of each cable, flattened
+            lmb_core   - Heat coefficient of the core of each cable
+            lmb_iso    - Heat coefficient of the insulation of each cable
+            lmb_fill   - Heat coefficient of the filling
+            fs         - Heat source of each cable
+            krylov_tol - Tolerance of the optimizer. If given, the state
+                         and adjoint are solved iteratively with a relative
+                         tolerance relative to it, see use_krylov, else LU
+        """
         self.J = 0
         self.dJ = 0
         self.opt_it = 0
         self.num_cables = len(scales)
-        self.outT = [File("output/T_%d.pvd" %i)
-                     for i in range(self.num_cables+1)]
+        self.writer = None # Created at first save_state
+        self.output_stride = 1 # Write every output_stride-th state
         self.lmb_core = lmb_core
         self.lmb_iso = lmb_iso
         self.lmb_fill = lmb_fill
@@ -23,13 +39,50 @@ class MultiCable():
         self.objdT = self.T*pow(abs(self.T), self.q-2) # Derivative of functional integrand
         self.T_amb = Constant(3.2) # Ambient Temperature
         self.c = Constant(0.01) # Reaction coefficient
+        self.init_forms()
+        self.cache_size = 8 # Number of evaluations kept in memory
+        self.cache = OrderedDict()
+        self.state_key = None # Positions of the current state
+        self.state_solver = None # Solver for state operator at state_key
+        self.factorized = False # State solver has been applied once
+        self.krylov = None # Iterative solver, direct LU if None
+        if krylov_tol is not None:
+            self.use_krylov(krylov_tol)
+
+    def use_krylov(self, optimizer_tol, factor=1e-2):
+        """
+        Solve state and adjoint with AMG preconditioned GMRES instead of LU.
+        The Nitsche heat operator is symmetric, but the reaction term
+        -c*T*v keeps it from being positive definite in general, so CG is
+        not safe. Consecutive optimizer iterates only move the cables
+        slightly, so the previous T and adjT are used as initial guesses.
+        Arguments:
+            optimizer_tol - Tolerance of the optimizer
+            factor        - Relative tolerance of the linear solves, relative
+                            to optimizer_tol
+        """
+        self.krylov = PETScKrylovSolver("gmres", "hypre_amg")
+        self.krylov.parameters["nonzero_initial_guess"] = True
+        self.krylov.parameters["relative_tolerance"] = factor*optimizer_tol
+        self.krylov.parameters["absolute_tolerance"] = 1e-14
+        self.krylov.parameters["maximum_iterations"] = 1000
+        self.state_solver = None
 
     def alpha_heat_transfer(self, T):
         return Constant(1.0)
 
     def save_state(self):
-        for i in range(self.multimesh.num_parts()):
-            self.outT[i] << self.T.part(i)
+        """ Append temperature and cable meshes to output/T.h5 """
+        if self.writer is None:
+            from hdf5_writer import TimeSeriesWriter
+            moving = range(1, self.num_cables+1)
+            self.writer = TimeSeriesWriter("output/T.h5", moving_parts=moving,
+                                           stride=self.output_stride)
+        parts = range(self.multimesh.num_parts())
+        with profiler.phase(IO):
+            self.writer.write([self.multimesh.part(i) for i in parts],
+                              {"T": [self.T.part(i) for i in parts]},
+                              t=self.opt_it)
         
     def init_multimesh(self,scales, positions):
         """
@@ -64,7 +117,8 @@ class MultiCable():
         self.multimesh = MultiMesh()
         for cable in self.cable_meshes:
             self.multimesh.add(cable)
-        self.multimesh.build()
+        with profiler.phase(BUILD):
+            self.multimesh.build()
         
     def init_source_and_heat_coeff(self, sources, metal, iso, fill):
         """ Initialize heat coefficient and source function 
@@ -95,6 +149,64 @@ class MultiCable():
                                 (self.cable_subdomains[i].array() == 15)*metal[i])
             self.lmb.assign_part(i+1, lmbx)
             
+    @profiler.timed(FORMS)
+    def init_forms(self):
+        """
+        Create the state, adjoint and shape gradient forms once.
+        The forms only depend on the multimesh through the facet normal
+        and circumradius, which are evaluated at assembly, so they are
+        reused for every functional and gradient evaluation.
+        """
+        n = FacetNormal(self.multimesh)
+        h = 2.0*Circumradius(self.multimesh)
+        h = (h('+') + h('-')) / 2
+        v = TestFunction(self.V)
+        Ttmp = TrialFunction(self.V)
+        constraint = inner(self.lmb*grad(Ttmp), grad(v))*dX \
+                     -self.f*v*dX -self.c*v*Ttmp*dX
+        constraint += self.alpha_heat_transfer(Ttmp)*(Ttmp-self.T_amb)*v*ds
+        constraint += - inner(avg(self.lmb*grad(Ttmp)), jump(v, n))*dI \
+                      - inner(avg(self.lmb*grad(v)), jump(Ttmp, n))*dI \
+                      + self.alpha/h*jump(Ttmp)*jump(v)*dI   \
+                      + self.beta*self.lmb*inner(jump(grad(Ttmp)), jump(grad(v)))*dO
+        self.a_state = lhs(constraint)
+        self.L_state = rhs(constraint)
+
+        # The adjoint operator is the transpose of the state operator.
+        # FIXME: Add derivative of alpha in ext bc constraint,only works for alpha=1
+        self.L_adjoint = -self.objdT*v*dX
+
+        # Shape gradient for each cable, evaluated with cable local copies
+        # of the state and adjoint
+        self.T_cables, self.adjT_cables, self.dJ_forms = [], [], []
+        for i, (cable_mesh, cable_facet,cable_subdomain) in enumerate(
+                zip(self.cable_meshes[1:], self.cable_facets,
+                    self.cable_subdomains)):
+            T_cable = self.T.part(i+1, deepcopy=True)
+            adjT_cable = self.adjT.part(i+1, deepcopy=True)
+            lmb_cable = self.lmb.part(i+1, deepcopy=True)
+            f_cable = self.f.part(i+1, deepcopy=True)
+            # Alternative to facet normal from femorph
+            #from femorph import VolumeNormal
+            #normal = VolumeNormal(cable_mesh, [0], cable_facet, [16,17])
+            normal = FacetNormal(cable_mesh)("-") # Outwards pointing normal
+            dJ_Surf = self.WeakCableShapeGradSurf(T_cable, adjT_cable,
+                                                  lmb_cable, self.c, f_cable,
+                                                  n=normal)
+            dSc1 = Measure("dS", subdomain_data=cable_facet, subdomain_id=16)
+            dSc2 = Measure("dS", subdomain_data=cable_facet, subdomain_id=17)
+            gradx = (normal[0]*dJ_Surf*dSc1
+                     +normal[0]*dJ_Surf*dSc2
+                     + Constant(0)*dx(domain=cable_mesh,
+                                      subdomain_data=cable_subdomain))
+            grady = (normal[1]*dJ_Surf*dSc1
+                     +normal[1]*dJ_Surf*dSc2
+                     + Constant(0)*dx(domain=cable_mesh,
+                                      subdomain_data=cable_subdomain))
+            self.T_cables.append(T_cable)
+            self.adjT_cables.append(adjT_cable)
+            self.dJ_forms.append((gradx, grady))
+
     def WeakCableShapeGradSurf(self, T, adjT, lmb, c, f, n):
         """ The Riez representer of the shape-surface gradient at an interface
         """
@@ -108,106 +220,165 @@ class MultiCable():
 
         return -dJ
 
-    @timed("USER_TIMING: Update meshes")
+    def lock_inactive_rhs(self, b):
+        """
+        Zero the right hand side at the inactive dofs, as lock_inactive_dofs
+        does, without touching the factorized operator
+        """
+        dofmap = self.V.dofmap()
+        b_local = b.get_local()
+        for i in range(self.multimesh.num_parts()):
+            b_local[dofmap.inactive_dofs(self.multimesh, i)] = 0
+        b.set_local(b_local)
+        b.apply("insert")
+
+    @profiler.timed(UPDATE_MESH)
     def update_mesh(self,cable_positions):
-        """ Translate all new_cables to a new center """
+        """ Translate all new_cables to a new center, returning the
+        multimesh parts that moved """
         cable_r = cable_positions.reshape(-1, 2)
         old_pos = self.cable_positions.reshape(-1, 2)
+        moved = set()
         for i, ((oldx,oldy), (newx, newy),
                 cable_mesh) in enumerate(zip(old_pos, cable_r,
                                              self.cable_meshes[1:])):
-            cable_mesh.translate(Point(-oldx+newx, -oldy+newy))
+            if oldx != newx or oldy != newy:
+                cable_mesh.translate(Point(-oldx+newx, -oldy+newy))
+                moved.add(i+1)
 
         self.cable_positions = cable_positions.copy()
+        return moved
 
-        
+    def rebuild_multimesh(self, moved_parts):
+        """
+        Rebuild the multimesh after the given parts have been moved.
+        This is not a partial rebuild: MultiMesh.build always recomputes
+        the collisions and quadrature rules of all parts. The check on
+        moved_parts is only a guard against rebuilding an unchanged
+        multimesh, as points already evaluated are served by the cache.
+        """
+        if len(moved_parts) == 0:
+            return
+        with profiler.phase(BUILD):
+            self.multimesh.build()
+
+
+    def cache_key(self, cable_positions):
+        return numpy.asarray(cable_positions, dtype=float).tobytes()
+
+    def cache_lookup(self, cable_positions):
+        """
+        Return the stored evaluation at the given positions, or None.
+        If the current state was computed at other positions, the meshes
+        and state are moved back to the stored point.
+        """
+        key = self.cache_key(cable_positions)
+        if key not in self.cache:
+            return None
+        self.cache.move_to_end(key)
+        entry = self.cache[key]
+        if key != self.state_key:
+            self.rebuild_multimesh(
+                self.update_mesh(numpy.array(cable_positions, dtype=float)))
+            self.T.vector()[:] = entry["T"]
+            self.state_key = key
+            self.state_solver = None
+        self.J = entry["J"]
+        return entry
 
+    def cache_store(self, **values):
+        """ Store values for the current state, evicting the oldest entry """
+        self.cache.setdefault(self.state_key, {}).update(values)
+        self.cache.move_to_end(self.state_key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def factorize_state(self):
+        """
+        Assemble the state operator on the current multimesh and attach it
+        to the state solver, returning the corresponding right hand side.
+        The LU factorization, or the AMG hierarchy of the iterative
+        solver, is computed by dolfin at the first solve, see solve_state.
+        """
+        with profiler.phase(ASSEMBLE):
+            A = assemble_multimesh(self.a_state)
+            b = assemble_multimesh(self.L_state)
+        with profiler.phase(LOCK):
+            self.V.lock_inactive_dofs(A, b)
+        # Keep the solver, such that the factorization can be reused
+        # for the adjoint equation
+        self.A = A
+        if self.krylov is None:
+            self.state_solver = LUSolver(self.A)
+        else:
+            self.krylov.set_operator(self.A)
+            self.state_solver = self.krylov
+        self.factorized = False
+        return b
+
+    def solve_state(self, x, b):
+        """
+        Solve with the state operator. The first solve after
+        factorize_state is timed as factorization, as it includes the
+        factorization or preconditioner setup, the later solves only
+        reuse it.
+        """
+        with profiler.phase(SOLVE if self.factorized else FACTORIZE):
+            self.state_solver.solve(x, b)
+        self.factorized = True
 
     """ Evaluate the functional with given cable_positions"""
     def eval_J(self, cable_positions):
-        # Update mesh
-        self.update_mesh(cable_positions)
-        with Timer("USER_TIMING: REBUILD MULTIMESH") as t:
-            self.multimesh.build()  # Rebuild the multimesh
-        n = FacetNormal(self.multimesh)
-        h = 2.0*Circumradius(self.multimesh)
-        h = (h('+') + h('-')) / 2
-        v = TestFunction(self.V)
-        Ttmp = TrialFunction(self.V)
-        constraint = inner(self.lmb*grad(Ttmp), grad(v))*dX \
-                     -self.f*v*dX -self.c*v*Ttmp*dX
-        constraint += self.alpha_heat_transfer(Ttmp)*(Ttmp-self.T_amb)*v*ds
-        constraint += - inner(avg(self.lmb*grad(Ttmp)), jump(v, n))*dI \
-                      - inner(avg(self.lmb*grad(v)), jump(Ttmp, n))*dI \
-                      + self.alpha/h*jump(Ttmp)*jump(v)*dI   \
-                      + self.beta*self.lmb*inner(jump(grad(Ttmp)), jump(grad(v)))*dO
-        with Timer("USER_TIMING: Assemble State") as t:
-            A = assemble_multimesh(lhs(constraint))
-            b = assemble_multimesh(rhs(constraint))
-        self.T.vector()[:]=0
-        self.V.lock_inactive_dofs(A, b)
-        with Timer("USER_TIMING: Solve State") as t:
-            solve(A, self.T.vector(), b, 'lu')
-        self.J = assemble_multimesh(self.obj)
+        if self.cache_lookup(cable_positions) is not None:
+            return self.J
+        # Update mesh and rebuild the multimesh
+        self.rebuild_multimesh(self.update_mesh(cable_positions))
+        b = self.factorize_state()
+        # The previous state is kept as initial guess for the Krylov solver
+        self.solve_state(self.T.vector(), b)
+        with profiler.phase(ASSEMBLE):
+            self.J = assemble_multimesh(self.obj)
+        self.state_key = self.cache_key(cable_positions)
+        self.cache_store(J=self.J, T=self.T.vector().get_local())
         return self.J
 
 
     # Evaluate the shape gradient
     def eval_dJ(self, cable_positions):
+        entry = self.cache_lookup(cable_positions)
+        if entry is not None and "dJ" in entry:
+            self.adjT.vector()[:] = entry["adjT"]
+            self.dJ = entry["dJ"].copy()
+            return self.dJ
         # Update mesh
         self.eval_J(cable_positions)
+        if self.state_solver is None:
+            # State restored from cache, factorization needed for adjoint
+            self.factorize_state()
         dJ = []
-        # Solve adjoint equation
-        adj = TrialFunction(self.V)
-        v = TestFunction(self.V)
-        n = FacetNormal(self.multimesh)
-        h = 2.0*Circumradius(self.multimesh)
-        h = (h('+') + h('-')) / 2
-        constraint = inner(self.lmb*grad(adj), grad(v))*dX -self.c*v*adj*dX
-        # FIXME: Add derivative of alpha in ext bc constraint,only works for alpha=1
-        constraint += adj*1*v*ds# alpha_heat_transfer(T)*v*ds
-        constraint += - inner(avg(self.lmb*grad(adj)), jump(v, n))*dI \
-                      - inner(avg(self.lmb*grad(v)), jump(adj, n))*dI \
-                      + self.alpha/h*jump(adj)*jump(v)*dI   \
-                      + self.beta*self.lmb*inner(jump(grad(adj)),
-                                                 jump(grad(v)))*dO
-        constraint += self.objdT*v*dX
-        A = assemble_multimesh(lhs(constraint))
-        b = assemble_multimesh(rhs(constraint))
-        self.V.lock_inactive_dofs(A, b)
-        solve(A, self.adjT.vector(), b, 'lu')
+        # Solve adjoint equation. The state operator is symmetric after
+        # locking the inactive dofs, so the factorization from eval_J
+        # solves the transposed system directly. The Krylov solver starts
+        # from the previous adjoint.
+        with profiler.phase(ASSEMBLE):
+            b = assemble_multimesh(self.L_adjoint)
+        with profiler.phase(LOCK):
+            self.lock_inactive_rhs(b)
+        self.solve_state(self.adjT.vector(), b)
 
-        for i, (cable_mesh, cable_facet,cable_subdomain) in enumerate(
-                zip(self.cable_meshes[1:], self.cable_facets,
-                    self.cable_subdomains)):
-            T_cable = self.T.part(i+1, deepcopy=True)
-            adjT_cable = self.adjT.part(i+1, deepcopy=True)
-            lmb_cable = self.lmb.part(i+1, deepcopy=True)
-            f_cable = self.f.part(i+1, deepcopy=True)
-            # Alternative to facet normal from femorph
-            #from femorph import VolumeNormal
-            #normal = VolumeNormal(cable_mesh, [0], cable_facet, [16,17])
-            normal = FacetNormal(cable_mesh)("-") # Outwards pointing normal
-            dJ_Surf = self.WeakCableShapeGradSurf(T_cable, adjT_cable,
-                                                  lmb_cable, self.c, f_cable,
-                                                  n=normal)
-            dSc1 = Measure("dS", subdomain_data=cable_facet, subdomain_id=16)
-            dSc2 = Measure("dS", subdomain_data=cable_facet, subdomain_id=17)
-            gradx = assemble(normal[0]*dJ_Surf*dSc1
-                             +normal[0]*dJ_Surf*dSc2
-                             + Constant(0)*dx(domain=cable_mesh,
-                                              subdomain_data=cable_subdomain))
-            grady = assemble(normal[1]*dJ_Surf*dSc1
-                             +normal[1]*dJ_Surf*dSc2
-                             + Constant(0)*dx(domain=cable_mesh,
-                                              subdomain_data=cable_subdomain))
-
-
-            dJ.append(gradx)
-            dJ.append(grady)
+        with profiler.phase(GRADIENT):
+            for i, (gradx, grady) in enumerate(self.dJ_forms):
+                self.T_cables[i].vector()[:] = self.T.part(
+                    i+1, deepcopy=True).vector()
+                self.adjT_cables[i].vector()[:] = self.adjT.part(
+                    i+1, deepcopy=True).vector()
+                dJ.append(assemble(gradx))
+                dJ.append(assemble(grady))
         self.dJ = numpy.array(dJ)
         # print("Gradients")
         # print(self.dJ)
+        self.cache_store(dJ=self.dJ.copy(),
+                         adjT=self.adjT.vector().get_local())
         return self.dJ
 
     def callback(self, positions, result):
@@ -215,6 +386,7 @@ class MultiCable():
         self.save_state()
         print("Iteration: %d" % self.opt_it)
         self.opt_it += 1
+        profiler.next_iteration()
         print("J: %.5e" % self.J)
         print("Gradients")
         print(", ".join(['{:2.8f}'.format(i).rjust(5) for i in self.dJ]))
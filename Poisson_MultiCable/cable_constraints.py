@@ -0,0 +1,115 @@
+import numpy
+
+
+def pair_distances(inner_radius, distance_from_internal):
+    """
+    Minimal distance between the centers of each pair of cables
+    """
+    inner_radius = numpy.asarray(inner_radius, dtype=float)
+    return (inner_radius[:, numpy.newaxis] + inner_radius[numpy.newaxis, :]
+            + distance_from_internal)
+
+def all_pairs(num_cables):
+    """
+    All pairs (i, j), i<j, in the order (0,1), (0,2), ..., (1,2), ...
+    """
+    return numpy.array(numpy.triu_indices(num_cables, 1)).T.reshape(-1, 2)
+
+def candidate_pairs(cable_positions, min_distance, margin):
+    """
+    Pairs (i, j), i<j, with centers closer than min_distance[i, j]+margin.
+    The cables are hashed into a uniform grid with the largest search
+    distance as cell size, so only cables in neighbouring cells are
+    compared, and the cost scales with the number of neighbours.
+    """
+    xy = numpy.asarray(cable_positions, dtype=float).reshape(-1, 2)
+    cutoff = numpy.asarray(min_distance, dtype=float) + margin
+    if len(xy) < 2:
+        return numpy.zeros((0, 2), dtype=int)
+    cell_size = numpy.max(cutoff)
+    grid = {}
+    for k, cell in enumerate(map(tuple, numpy.floor(xy/cell_size).astype(int))):
+        grid.setdefault(cell, []).append(k)
+
+    pairs = []
+    for (cx, cy), members in grid.items():
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for j in grid.get((cx+dx, cy+dy), []):
+                    for i in members:
+                        if i < j and (numpy.sum((xy[i]-xy[j])**2)
+                                      < cutoff[i, j]**2):
+                            pairs.append((i, j))
+    return numpy.array(sorted(pairs), dtype=int).reshape(-1, 2)
+
+
+class CableConstraints():
+    """
+    Maximum radius and pairwise non-collision constraints, g(x) <= 0, for
+    cables with centers x = [x0, y0, x1, y1, ...]:
+        g_i  = x_i^2 + y_i^2 - R_i^2,                 i = 0,...,n-1
+        g_ij = r_ij^2 - (x_i-x_j)^2 - (y_i-y_j)^2,    (i,j) in pairs
+    Each radius constraint depends on two controls and each pair
+    constraint on four, so the Jacobian is given in sparse triplet format.
+    """
+    def __init__(self, max_radius, min_distance, pairs=None):
+        """
+        Arguments:
+            max_radius   - Maximal distance R_i from origo for each cable
+            min_distance - (n, n) array of the minimal distance r_ij
+                           between cable i and j
+            pairs        - (m, 2) array of pairs (i, j) with a
+                           non-collision constraint, all pairs if None
+        """
+        self.max_radius = numpy.asarray(max_radius, dtype=float)
+        self.min_distance = numpy.asarray(min_distance, dtype=float)
+        self.num_cables = len(self.max_radius)
+        if pairs is None:
+            pairs = all_pairs(self.num_cables)
+        self.set_pairs(pairs)
+
+    def set_pairs(self, pairs):
+        """
+        Set the pairs with non-collision constraints and the corresponding
+        Jacobian structure
+        """
+        self.pairs = numpy.asarray(pairs, dtype=int).reshape(-1, 2)
+        self.i, self.j = self.pairs[:, 0], self.pairs[:, 1]
+        self.r_sq = self.min_distance[self.i, self.j]**2
+        n, m = self.num_cables, len(self.pairs)
+        self.num_constraints = n + m
+        self.num_nonzeros = 2*n + 4*m
+
+        cables = numpy.arange(n)
+        rows_radius = numpy.repeat(cables, 2)
+        cols_radius = numpy.vstack((2*cables, 2*cables+1)).T.flatten()
+        rows_pair = numpy.repeat(n + numpy.arange(m), 4)
+        cols_pair = numpy.vstack((2*self.i, 2*self.i+1,
+                                  2*self.j, 2*self.j+1)).T.flatten()
+        self.rows = numpy.concatenate((rows_radius, rows_pair))
+        self.cols = numpy.concatenate((cols_radius, cols_pair))
+
+    def g(self, cable_positions):
+        """ Evaluate the constraints """
+        xy = numpy.asarray(cable_positions, dtype=float).reshape(-1, 2)
+        g_radius = numpy.sum(xy**2, axis=1) - self.max_radius**2
+        diff = xy[self.i] - xy[self.j]
+        g_pair = self.r_sq - numpy.sum(diff**2, axis=1)
+        return numpy.concatenate((g_radius, g_pair))
+
+    def jac_structure(self):
+        """ Row and column index of each nonzero in the Jacobian """
+        return (self.rows, self.cols)
+
+    def jac(self, cable_positions):
+        """ Values of the nonzeros in the Jacobian, ordered as jac_structure """
+        xy = numpy.asarray(cable_positions, dtype=float).reshape(-1, 2)
+        diff = xy[self.i] - xy[self.j]
+        return numpy.concatenate(((2*xy).flatten(),
+                                  numpy.hstack((-2*diff, 2*diff)).flatten()))
+
+    def dense_jac(self, cable_positions):
+        """ The Jacobian as a dense (num_constraints, 2n) array """
+        jac = numpy.zeros((self.num_constraints, 2*self.num_cables))
+        jac[self.rows, self.cols] = self.jac(cable_positions)
+        return jac
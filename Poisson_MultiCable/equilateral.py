@@ -56,22 +56,15 @@ opt_sol = opt.solve(cable_positions)
 compute_angles(opt_sol)
 MC.eval_J(opt_sol)
 print("Optimal J: %.2e" % MC.J)
+from active_dofs import ActiveDofMask
+active = ActiveDofMask(MC.T.function_space())
 def plot_init_opt(init, opt,filename,colorbar=True):
     plt.subplot(1,2,1)
     MC.eval_J(init)
-    MC.T.vector().get_local().copy()
-    
-    T_max_arr = MC.T.vector().get_local()
-    inactive = MC.T.function_space().dofmap().inactive_dofs(MC.multimesh, 0)
-    T_stripped = [val for idx, val in enumerate(T_max_arr)
-                  if idx not in inactive]
-    T_max = numpy.max(T_stripped)
+    T_max = active.max(MC.T)
     MC.eval_J(opt)
-    T_min_arr = MC.T.vector().get_local()   
-    inactive = MC.T.function_space().dofmap().inactive_dofs(MC.multimesh, 0)
-    T_stripped = [val for idx, val in enumerate(T_min_arr)
-                  if idx not in inactive]
-    T_min = numpy.min(T_stripped)
+    T_min = active.min(MC.T)
+    T_stripped = active.active_values(MC.T)
     MC.eval_J(init)
     
     # Strip T of inactive dofs values
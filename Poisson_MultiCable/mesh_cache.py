@@ -0,0 +1 @@
+../common/mesh_cache.py
\ No newline at end of file
@@ -0,0 +1,182 @@
+"""
+Multi-start optimization of the cable layout. Random feasible layouts are
+optimized by independent Ipopt runs in a pool of worker processes, each
+holding its own MultiCable. The best optima are kept, and a run is
+cancelled when its objective has stalled above the objectives of the
+best runs finished so far.
+"""
+from multiprocessing import get_context, cpu_count
+import numpy
+from cable_constraints import CableConstraints
+
+_MC = None # MultiCable of the current worker process
+_cutoff = None # Shared objective a run has to beat to be continued
+
+def feasible_layouts(max_radius, min_distance, num_layouts, slack=0.0,
+                     seed=0, max_tries=100):
+    """
+    Random cable layouts satisfying g(x) <= -slack.
+    The cables are placed one at a time, uniformly in the disk they are
+    allowed in, and a cable is redrawn until it is clear of the already
+    placed cables. The x-coordinate of the first cable is 0, as it is
+    fixed in MultiCableOptimization.
+    Arguments:
+        max_radius   - Maximal distance from origo for each cable
+        min_distance - (n, n) array of the minimal distance between cables
+        num_layouts  - Number of layouts to generate
+        slack        - Minimal margin to the constraints
+        seed         - Seed of the random generator
+        max_tries    - Draws of a cable before the layout is restarted
+    Returns an array of shape (num_layouts, 2*n)
+    """
+    rng = numpy.random.RandomState(seed)
+    max_radius = numpy.asarray(max_radius, dtype=float)
+    n = len(max_radius)
+    constraints = CableConstraints(max_radius, min_distance)
+    layouts = []
+    while len(layouts) < num_layouts:
+        xy = numpy.zeros((n, 2))
+        for i in range(n):
+            for _ in range(max_tries):
+                radius = (max_radius[i]**2 - slack)**0.5
+                if i == 0:
+                    xy[i] = 0, radius*rng.uniform(-1, 1)
+                else:
+                    r, theta = radius*rng.rand()**0.5, 2*numpy.pi*rng.rand()
+                    xy[i] = r*numpy.cos(theta), r*numpy.sin(theta)
+                distance2 = numpy.sum((xy[:i] - xy[i])**2, axis=1)
+                if numpy.all(distance2 >= min_distance[i, :i]**2 + slack):
+                    break
+            else:
+                break
+        else:
+            layout = xy.flatten()
+            # Guard against round off at the boundary of the disks
+            if numpy.all(constraints.g(layout) <= -slack):
+                layouts.append(layout)
+    return numpy.array(layouts)
+
+def init_worker(cable_args, cutoff):
+    """ Create the MultiCable used by this worker """
+    global _MC, _cutoff
+    from MultiCable import MultiCable
+    _MC = MultiCable(*cable_args)
+    _cutoff = cutoff
+
+def dominated(objectives, cutoff, window, stall):
+    """
+    A run is dominated if its objective is above cutoff and has decreased
+    less than the relative amount stall over the last window iterations
+    """
+    if len(objectives) <= window or objectives[-1] <= cutoff:
+        return False
+    previous = objectives[-1-window]
+    return previous - objectives[-1] < stall*abs(previous)
+
+def run_start(args):
+    """ Optimize the cable layout from one starting layout """
+    from IpoptMultiCableSolver import MultiCableOptimization
+    index, start, scales, options, window, stall = args
+    objectives = []
+    cancelled = []
+    def intermediate(alg_mod, iter_count, obj_value, *args):
+        objectives.append(obj_value)
+        if dominated(objectives, _cutoff.value, window, stall):
+            cancelled.append(iter_count)
+            return False
+        return True
+
+    opt = MultiCableOptimization(len(scales), scales, _MC.eval_J, _MC.eval_dJ)
+    opt.int_option("print_level", 0)
+    for name, value in options.items():
+        if isinstance(value, str):
+            opt.str_option(name, value)
+        elif isinstance(value, int):
+            opt.int_option(name, value)
+        else:
+            opt.num_option(name, value)
+    opt.set_intermediate_callback(intermediate)
+    positions = opt.solve(start)
+    # Objective at the returned layout, not the last Ipopt iterate
+    J = _MC.eval_J(positions)
+    return {"index": index, "start": start, "positions": positions,
+            "J": J, "status": opt.result[5], "cancelled": len(cancelled) > 0,
+            "objectives": numpy.array(objectives)}
+
+def multistart(cable_args, starts, keep=3, options=None, processes=None,
+               window=5, stall=1e-3):
+    """
+    Optimize the cable layout from each start in parallel.
+    Arguments:
+        cable_args - Arguments (scales, positions, lmb_core, lmb_iso,
+                     lmb_fill, fs) passed to MultiCable
+        starts     - Array with a feasible starting layout in each row
+        keep       - Number of best optima returned, and the number of
+                     finished runs before runs can be cancelled
+        options    - Ipopt options of each run, such as max_iter
+        processes  - Number of worker processes, defaults to all cores
+        window     - Iterations the objective decrease is measured over
+        stall      - Relative decrease over window below which a run above
+                     the keep best objectives is cancelled
+    Returns the keep best runs sorted by objective, and all runs in the
+    order of the starts.
+    """
+    if options is None:
+        options = {}
+    scales = numpy.asarray(cable_args[0], dtype=float)
+    if processes is None:
+        processes = min(len(starts), cpu_count())
+    context = get_context("spawn")
+    cutoff = context.Value("d", numpy.inf)
+    jobs = [(i, numpy.asarray(start, dtype=float), scales, options, window,
+             stall) for i, start in enumerate(starts)]
+    runs = []
+    # Spawn fresh interpreters, as forking an initialized dolfin is unsafe
+    with context.Pool(processes, initializer=init_worker,
+                      initargs=(cable_args, cutoff)) as pool:
+        for run in pool.imap_unordered(run_start, jobs):
+            runs.append(run)
+            finished = sorted(r["J"] for r in runs if not r["cancelled"])
+            if len(finished) >= keep:
+                cutoff.value = finished[keep-1]
+            print("Start %d: J=%.5e after %d iterations%s"
+                  % (run["index"], run["J"], len(run["objectives"]),
+                     " (cancelled)" if run["cancelled"] else ""))
+    runs.sort(key=lambda run: run["index"])
+    best = sorted([run for run in runs if not run["cancelled"]],
+                  key=lambda run: run["J"])[:keep]
+    return best, runs
+
+def save_runs(runs, filename):
+    """ Save the starts, optima and objectives of runs to a npz-file """
+    numpy.savez(filename,
+                index=[run["index"] for run in runs],
+                start=[run["start"] for run in runs],
+                positions=[run["positions"] for run in runs],
+                J=[run["J"] for run in runs],
+                status=[run["status"] for run in runs],
+                cancelled=[run["cancelled"] for run in runs])
+
+if __name__ == "__main__":
+    import sys
+    from IpoptMultiCableSolver import MultiCableOptimization
+    # Cable configuration of five_cables.py
+    lmb_metal = [205,205,205,205,205]
+    lmb_insulation = [0.03,0.12,0.06,0.04,0.02]
+    lmb_fill = 0.33
+    scales = numpy.array([1,0.75,0.9,1,0.8])
+    sources = numpy.array([10,5,2.5,5,10])
+    try:
+        num_starts = int(sys.argv[1])
+    except (IndexError, ValueError):
+        num_starts = 2*cpu_count()
+    _, max_radius, min_distance = MultiCableOptimization.layout_bounds(scales)
+    starts = feasible_layouts(max_radius, min_distance, num_starts,
+                              slack=1e-3)
+    cable_args = (scales, starts[0], lmb_metal, lmb_insulation, lmb_fill,
+                  sources)
+    best, runs = multistart(cable_args, starts, options={"max_iter": 50})
+    save_runs(runs, "output/multistart.npz")
+    for run in best:
+        print("J=%.8e from start %d:" % (run["J"], run["index"]))
+        print(", ".join("%.8f" % x for x in run["positions"]))
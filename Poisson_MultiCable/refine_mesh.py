@@ -1,24 +1,36 @@
 import sys
+from mesh_cache import cache_key, restore, store
+
+geo_files = ["meshes/cable.geo", "meshes/inner_cable_halo.geo"]
+# Files read by MultiCable
+mesh_files = ["meshes/%s%s.xml" % (name, region)
+              for name in ["cable", "inner_cable_halo"]
+              for region in ["", "_facet_region", "_physical_region"]]
+
 if __name__=="__main__":
     try:
         res = float(sys.argv[1])
     except:
         print("Invalid resolution")
         sys.exit(1)
-    with open('meshes/cable.geo', 'r') as file:
-        data = file.readlines()
-        data[1] = "res = %s;\n" % res
-        
-    with open('meshes/cable.geo', 'w') as file:
-        file.writelines( data )
+    sources = []
+    for geo_file in geo_files:
+        with open(geo_file, 'r') as file:
+            data = file.readlines()
+            data[1] = "res = %s;\n" % res
+        sources.append(data)
+
+    # The meshes are identified by the geo-files with the resolution set
+    key = cache_key(sources)
+    if restore(key, mesh_files):
+        print("Loaded meshes with resolution %s from mesh cache" % res)
+        sys.exit(0)
+
+    for geo_file, data in zip(geo_files, sources):
+        with open(geo_file, 'w') as file:
+            file.writelines( data )
 
-    with open('meshes/inner_cable_halo.geo', 'r') as file:
-        data = file.readlines()
-        data[1] = "res = %s;\n" % res
-        
-    with open('meshes/inner_cable_halo.geo', 'w') as file:
-        file.writelines( data )
- 
     import os
     os.system('rm meshes/cable.msh')
     os.system('make -C meshes')
+    store(key, mesh_files)
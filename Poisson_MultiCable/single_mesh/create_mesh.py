@@ -1,6 +1,7 @@
 import pygmsh
 import meshio
-from dolfin import timed, Timer
+import numpy
+from dolfin import timed, Timer, Mesh, MeshEditor, MeshFunction
 from IPython import embed
 outer_radius = 1.2
 rubber_radius = 0.255
@@ -13,7 +14,13 @@ metaliso = 100
 isofill = 200
 
 @timed("USER_TIMING: Creating mesh")
-def create_multicable(cable_pos, res=0.1):
+def create_multicable(cable_pos, res=0.1, write=True):
+    """
+    Generate the mesh of the cables at cable_pos with gmsh.
+    Returns the points, triangles, triangle markers, lines and line
+    markers. If write is True, the mesh, facet and cell markers are also
+    saved to multicable.xdmf, mf.xdmf and cf.xdmf.
+    """
     geo = pygmsh.built_in.geometry.Geometry()
     num_cables = int(len(cable_pos)/2)
     metal_circles = []
@@ -46,6 +53,10 @@ def create_multicable(cable_pos, res=0.1):
          cell_data, field_data) = pygmsh.generate_mesh(geo, prune_z_0=True,
                                                        verbose=True)#,
                                                        # geo_filename="mesh.geo")
+    data = (points, cells["triangle"], cell_data["triangle"]["gmsh:physical"],
+            cells["line"], cell_data["line"]["gmsh:physical"])
+    if not write:
+        return data
 
     meshio.write("multicable.xdmf",
                  meshio.Mesh(points=points, cells={"triangle": cells["triangle"]}))
@@ -57,5 +68,44 @@ def create_multicable(cable_pos, res=0.1):
         points=points, cells={"triangle": cells["triangle"]},
         cell_data={"triangle": {"name_to_read":
                                 cell_data["triangle"]["gmsh:physical"]}}))
+    return data
+
+@timed("USER_TIMING: Convert mesh")
+def multicable_to_dolfin(points, triangles, cell_markers, lines,
+                         facet_markers):
+    """
+    Create the dolfin mesh, facet function and cell function from the
+    arrays returned by create_multicable, without writing them to file.
+    """
+    mesh = Mesh()
+    editor = MeshEditor()
+    editor.open(mesh, "triangle", 2, 2)
+    editor.init_vertices(len(points))
+    editor.init_cells(len(triangles))
+    for i, point in enumerate(points):
+        editor.add_vertex(i, point[:2])
+    for i, cell in enumerate(triangles):
+        editor.add_cell(i, cell)
+    # Ordering only sorts the vertices of each cell, so the cell numbering
+    # of gmsh is kept
+    editor.close()
+
+    cf = MeshFunction("size_t", mesh, 2, 0)
+    cf.array()[:] = cell_markers
+
+    # Find the facet of each line by its sorted vertex pair
+    mesh.init(1, 0)
+    num_vertices = mesh.num_vertices()
+    facet_vertices = numpy.sort(mesh.topology()(1, 0)().reshape(-1, 2),
+                                axis=1).astype(numpy.int64)
+    facet_keys = facet_vertices[:,0]*num_vertices + facet_vertices[:,1]
+    line_vertices = numpy.sort(numpy.asarray(lines), axis=1).astype(numpy.int64)
+    line_keys = line_vertices[:,0]*num_vertices + line_vertices[:,1]
+    order = numpy.argsort(facet_keys)
+    facet_ids = order[numpy.searchsorted(facet_keys, line_keys, sorter=order)]
+    mf = MeshFunction("size_t", mesh, 1, 0)
+    mf.array()[facet_ids] = facet_markers
+    return mesh, mf, cf
+
 if __name__ == "__main__":
     create_multicable([0.1,0.1,-0.6,-0.7])
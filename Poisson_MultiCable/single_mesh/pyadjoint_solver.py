@@ -38,18 +38,9 @@ class MultiCable():
         
     def init_mesh(self, positions,res):
         self.res = res
-        create_multicable(positions,res)
-        self.mesh = Mesh()
-        with XDMFFile("multicable.xdmf") as infile:
-            infile.read(self.mesh)
-        mvc = MeshValueCollection("size_t", self.mesh, 1)
-        with XDMFFile("mf.xdmf") as infile:
-            infile.read(mvc, "name_to_read")
-        self.mf = cpp.mesh.MeshFunctionSizet(self.mesh, mvc)
-        mvc = MeshValueCollection("size_t", self.mesh, 2)
-        with XDMFFile("cf.xdmf") as infile:
-            infile.read(mvc, "name_to_read")
-        self.cf = cpp.mesh.MeshFunctionSizet(self.mesh, mvc)
+        # Mesh and markers are passed in memory, not through xdmf-files
+        self.mesh, self.mf, self.cf = multicable_to_dolfin(
+            *create_multicable(positions, res, write=False))
 
 
     def init_source_and_heat_coeff(self, sources, metal, iso, fill):
@@ -0,0 +1,96 @@
+"""
+Taylor test for the MultiCable shape gradient, where the perturbed
+functionals are evaluated in parallel by a pool of worker processes.
+Each worker holds its own MultiCable, and thereby its own copy of the
+meshes, so the evaluations are independent of each other.
+"""
+from multiprocessing import get_context, cpu_count
+import numpy
+
+_MC = None # MultiCable of the current worker process
+
+def convergence_rates(E_values, eps_values):
+    r = []
+    for i in range(1, len(eps_values)):
+        r.append(numpy.log(E_values[i]/E_values[i-1])/
+                 numpy.log(eps_values[i]/eps_values[i-1]))
+    return r
+
+def init_worker(cable_args):
+    """ Create the MultiCable used by this worker """
+    global _MC
+    from MultiCable import MultiCable
+    _MC = MultiCable(*cable_args)
+
+def eval_J_worker(cable_positions):
+    return _MC.eval_J(cable_positions)
+
+def taylor_test(cable_args, cable_positions, perturbation, epsilon,
+                processes=None):
+    """
+    Compute the Taylor residuals of the functional at cable_positions
+    in the given perturbation direction.
+    Arguments:
+        cable_args    - Arguments (scales, positions, lmb_core, lmb_iso,
+                        lmb_fill, fs) passed to MultiCable
+        cable_positions - Point where the gradient is tested
+        perturbation  - Direction of the perturbation
+        epsilon       - List of perturbation lengths
+        processes     - Number of worker processes, defaults to one per
+                        perturbation, bounded by the number of cores
+    Returns a dictionary with the perturbation lengths, functional values,
+    zeroth and first order residuals and their convergence rates.
+    """
+    from MultiCable import MultiCable
+    cable_positions = numpy.array(cable_positions, dtype=float)
+    perturbation = numpy.array(perturbation, dtype=float)
+    MC = MultiCable(*cable_args)
+    num_cells = 0
+    for i in range(MC.multimesh.num_parts()):
+        num_cells += MC.multimesh.part(i).num_cells()
+    dJ = MC.eval_dJ(cable_positions)
+    dJp = numpy.dot(dJ, perturbation)
+    J = MC.J
+
+    points = [cable_positions+eps*perturbation for eps in epsilon]
+    if processes is None:
+        processes = min(len(points), cpu_count())
+    # Spawn fresh interpreters, as forking an initialized dolfin is unsafe
+    with get_context("spawn").Pool(processes, initializer=init_worker,
+                                   initargs=(cable_args,)) as pool:
+        J_eps = numpy.array(pool.map(eval_J_worker, points))
+
+    res_0 = numpy.abs(J_eps-J)
+    res_1 = numpy.abs(J_eps-J-numpy.array(epsilon)*dJp)
+    return {"num_cells": num_cells, "epsilon": numpy.array(epsilon),
+            "J": J, "dJ": dJ, "J_eps": J_eps,
+            "res_0": res_0, "res_1": res_1,
+            "rate_0": numpy.array(convergence_rates(res_0, epsilon)),
+            "rate_1": numpy.array(convergence_rates(res_1, epsilon))}
+
+def print_result(result):
+    """ Print result in the format of taylor_test.py """
+    print("#Cells", result["num_cells"])
+    for key in ["epsilon", "res_0", "res_1", "rate_0", "rate_1"]:
+        print(' '.join('{:1.5e}'.format(k) for k in result[key]))
+
+def save_results(results, filename):
+    """
+    Save a list of Taylor test results to a npz-file, prefixing each
+    array with the index of the result
+    """
+    data = {}
+    for i, result in enumerate(results):
+        for key in result.keys():
+            data["%d_%s" % (i, key)] = result[key]
+    numpy.savez(filename, num_results=len(results), **data)
+
+def load_results(filename):
+    """ Load list of Taylor test results saved with save_results """
+    data = numpy.load(filename)
+    results = []
+    for i in range(int(data["num_results"])):
+        prefix = "%d_" % i
+        results.append({key[len(prefix):]: data[key] for key in data.files
+                        if key.startswith(prefix)})
+    return results
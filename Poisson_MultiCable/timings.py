@@ -27,6 +27,9 @@ for eps in epsilon:
     dJ_eps = MC.eval_dJ(c1+eps*perturbation)
 
 list_timings(TimingClear.clear, [TimingType.wall])
+from profiler import profiler
+profiler.report()
+profiler.write_json("output/timings.json")
 embed()
 dJp = numpy.dot(dJ, perturbation)
 print(MC.J,dJ)
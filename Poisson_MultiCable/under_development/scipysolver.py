@@ -1,7 +1,7 @@
 from IPython import embed
 import numpy
 from pdb import set_trace
-import sympy
+from cable_constraints import CableConstraints, pair_distances
 from scipy.optimize import minimize, NonlinearConstraint
 
 
@@ -18,13 +18,12 @@ class MultiCableOptimization():
         self.inner_radius *= cable_scales
         self.max_radius = self.outer_radius - self.inner_radius\
                           - self.distance_from_outer
-        self.sympy_g(self.num_cables)
-        self.sympy_jac_g()
+        self.init_constraints()
         self.constraint_init()
 
     def eval_g(self, x):
-        """ Evaluate inequality constraint, g(x) <= 0, """
-        return self.replace_sympy_g(x)
+        """ Evaluate inequality constraint, g(x) >= 0, """
+        return -self.g_scale*self.constraints.g(x)
 
 
     def eval_jac_g(self, cable_positions, flag=False):
@@ -33,66 +32,21 @@ class MultiCableOptimization():
         flag = False means 'give me the Jacobian'.
         """
         if flag:
-            # FIXME: Pass in a dense matrix
-            # (could be optimised, but we don't care for this small problem).
-            nvar = len(cable_positions)
-            n_cables = int(nvar/2)
-            ncon = int(n_cables + n_cables*(n_cables-1)/2)
-            rows = []
-            for i in range(ncon):
-                rows += [i] * nvar
-            cols = list(range(nvar)) * ncon
-            return (numpy.array(rows), numpy.array(cols))
+            return self.constraints.jac_structure()
         else:
-            return numpy.array(self.replace_sympy_jac_g(cable_positions))
+            return -self.g_scale*self.constraints.dense_jac(cable_positions)
 
-    
-    def sympy_g(self, num_cables):
+    def init_constraints(self):
         """ Creates the maximum distance and no-collision constraint 
-        for each sub-cables with sympy, returning the g in inequality g<=0 and
-        an array z of the control variables
+        for each sub-cables, with the sign convention g>=0 of scipy
         """
-        x = list(sympy.symbols("x0:%d" % num_cables))
-        y = list(sympy.symbols("y0:%d" % num_cables))
-        g,z= [],[]
-        for i in range(num_cables):
-            g.append(-(x[i]**2 + y[i]**2 - self.max_radius[i]**2))
-        for i in range(num_cables):
-            z.append(x[i])
-            z.append(y[i])
-            for j in range(i+1,num_cables):
-                xi, yi = x[i], y[i]
-                xj, yj = x[j], y[j]
-                int_radius = self.inner_radius[i] + self.inner_radius[j]\
-                             + self.distance_from_internal
-                # FIXME: Max_int_radius should change with each cable radius
-                g.append(-(int_radius**2 - (xi - xj)**2 - (yi - yj)**2))
-        self.g = sympy.Matrix(g)
-        self.z = sympy.Matrix(z)
-    
-
-    def sympy_jac_g(self):
-        """ Creates jacobian for constraints """
-        self.jac_g = self.g.jacobian(self.z)
-
-
-    def replace_sympy_g(self, positions):
-        """ Create numpy array of constraint at current positions """
-        g_numpy = self.g.subs([(self.z[i], positions[i])
-                               for i in range(2*self.num_cables)])
-        return self.g_scale*numpy.array(g_numpy).astype(float)
-
-
-    def replace_sympy_jac_g(self, positions):
-        """ Create numpy array of jacobian of constraint at
-        current positions """    
-        numpy_jac_g = self.jac_g.subs([(self.z[i], positions[i])
-                                       for i in range(2*self.num_cables)])
-        return self.g_scale*numpy.array(numpy_jac_g).astype(float)
+        self.constraints = CableConstraints(
+            self.max_radius, pair_distances(self.inner_radius,
+                                            self.distance_from_internal))
 
     def constraint_init(self):
         nvar = int(2*self.num_cables)
-        ncon = int(self.num_cables + self.num_cables*(self.num_cables-1)/2)
+        ncon = self.constraints.num_constraints
         low_var = -numpy.inf*numpy.ones(nvar,dtype=float)
         up_var = numpy.inf*numpy.ones(nvar, dtype=float)
         up_var[0], low_var[0] = 0, 0
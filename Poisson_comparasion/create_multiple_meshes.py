@@ -126,13 +126,23 @@ def single_mesh(res=0.025):
         cell_data={"line": {"name_to_read":
                             cell_data["line"]["gmsh:physical"]}}))
 
+def mesh_files(i):
+    """ Files written for the i-th mesh of the multimesh """
+    return ["meshes/%s_%d.%s" % (name, i, ext)
+            for name in ["multimesh", "mf"] for ext in ["xdmf", "h5"]]
+
         
 if __name__=="__main__":
     import sys
+    from mesh_cache import cached_mesh
     try:
         res = float(sys.argv[1])
     except IndexError:
         res = 0.0125
-    background_mesh(res)
-    front_mesh(res)
-    single_mesh(res)
+    params = {"L": L, "H": H, "c_x": c_x, "c_y": c_y, "r_x": r_x, "r_y": r_y,
+              "inner_marker": inner_marker, "outer_marker": outer_marker}
+    cached_mesh(background_mesh, res, mesh_files(0), params)
+    cached_mesh(front_mesh, res, mesh_files(1), params)
+    cached_mesh(single_mesh, res, ["meshes/singlemesh.xdmf",
+                                   "meshes/singlemesh.h5",
+                                   "meshes/mf.xdmf", "meshes/mf.h5"], params)
@@ -2,10 +2,13 @@ from dolfin import *
 import matplotlib.pyplot as plt
 from IPython import embed
 from pdb import set_trace
+from facet_markers import FacetMarkerStore
 # MultiMesh stability parameters
 alpha = 4.0
 beta = 4.0
 set_log_level(LogLevel.ERROR)
+# Facet markers are read once, and reused for the deformed meshes
+facet_markers = FacetMarkerStore("meshes/mf_%d.xdmf")
 
 # Creating dx/dtheta around center (1.25,0.875)
 # sx = "-x[1]+0.875"
@@ -32,12 +35,7 @@ def solve_poisson(multimesh):
     """
     # Create function space for the temperature
     V = MultiMeshFunctionSpace(multimesh, "CG", 1)
-    mfs = []
-    for i in range(2):
-        mvc = MeshValueCollection("size_t", multimesh.part(i), 1)
-        with XDMFFile("meshes/mf_%d.xdmf" %i) as infile:
-            infile.read(mvc, "name_to_read")
-        mfs.append(cpp.mesh.MeshFunctionSizet(multimesh.part(i), mvc))
+    mfs = facet_markers.load(multimesh)
     mf_0 = mfs[0]
     mf_1 = mfs[1]
 
@@ -85,12 +83,7 @@ def solve_adjoint(T):
     Computes the adjoint solution of the Poisson problem given solution T
     """
     multimesh = T.function_space().multimesh()
-    mfs = []
-    for i in range(2):
-        mvc = MeshValueCollection("size_t", multimesh.part(i), 1)
-        with XDMFFile("meshes/mf_%d.xdmf" %i) as infile:
-            infile.read(mvc, "name_to_read")
-        mfs.append(cpp.mesh.MeshFunctionSizet(multimesh.part(i), mvc))
+    mfs = facet_markers.load(multimesh)
     mf_0 = mfs[0]
     mf_1 = mfs[1]
 
@@ -159,12 +152,7 @@ def deformation_vector(multimesh):
     n0 = VolumeNormal(multimesh.part(0))
     n1 = VolumeNormal(multimesh.part(1))
     S = MultiMeshVectorFunctionSpace(multimesh, "CG", 1)
-    mfs = []
-    for i in range(2):
-        mvc = MeshValueCollection("size_t", multimesh.part(i), 1)
-        with XDMFFile("meshes/mf_%d.xdmf" %i) as infile:
-            infile.read(mvc, "name_to_read")
-        mfs.append(cpp.mesh.MeshFunctionSizet(multimesh.part(i), mvc))
+    mfs = facet_markers.load(multimesh)
     mf_0 = mfs[0]
     mf_1 = mfs[1]
 
@@ -3,6 +3,8 @@ import matplotlib.pyplot as plt
 import numpy as np
 import os
 from IPython import embed
+from profiler import profiler, BUILD, AUTO_COVER, FORMS, ASSEMBLE, BCS, LOCK,\
+    SOLVE, GRADIENT, IO
 set_log_level(LogLevel.ERROR)
 os.system("mkdir -p results")
 os.system("mkdir -p figures")
@@ -19,7 +21,9 @@ class PoissonSolver():
            facet_func_names [str, str] List of filenames for facet functions
            source - Source expression or dolfin function
         """
-        self.out = [File("output/all_track.pvd"),File("output/all_track1.pvd")]
+        self.writer = None # Created at first output
+        self.save_output = True # Write state to output at every eval_J
+        self.output_stride = 1 # Write every output_stride-th state
         self.f = source
         self.point = p
         self.s = Expression(("-x[1]+%s" % p[1], "x[0]-%s" % p[0]),degree=3)
@@ -29,6 +33,7 @@ class PoissonSolver():
         self.V = MultiMeshFunctionSpace(self.multimesh, "CG", 1)
         self.T = MultiMeshFunction(self.V, name="state")
         self.lmb = MultiMeshFunction(self.V, anme="adjoint")
+        self.init_forms()
         
     def init_multimesh(self, meshes_n, facet_funcs,theta,p): 
         multimesh = MultiMesh()
@@ -46,7 +51,8 @@ class PoissonSolver():
                 mesh_i.rotate(theta, 2, p)
             meshes.append(mesh_i)
             multimesh.add(mesh_i)
-        multimesh.build()
+        with profiler.phase(BUILD):
+            multimesh.build()
         self.mfs = mfs
         self.meshes = meshes
         self.multimesh = multimesh
@@ -61,7 +67,8 @@ class PoissonSolver():
             angle = angle[0]
         
         self.meshes[1].rotate(angle-self.theta, 2, self.point)
-        self.multimesh.build()
+        with profiler.phase(BUILD):
+            self.multimesh.build()
         self.theta = angle
 
     # Helper functions for state and adjoint
@@ -82,11 +89,14 @@ class PoissonSolver():
         """
         return 0.5*T*T*dX
 
-    def eval_J(self, angle):
+    @profiler.timed(FORMS)
+    def init_forms(self):
         """
-        Evaluates functional with object rotated at given angle
+        Create the state and adjoint forms, boundary conditions and
+        functional once. The forms only depend on the multimesh through
+        the facet normal and circumradius, which are evaluated at assembly,
+        so they are reused for every evaluation.
         """
-        self.update_mesh(angle)
         mf_0, mf_1 = self.mfs
 
         # Define trial and test functions and right-hand side
@@ -98,35 +108,66 @@ class PoissonSolver():
         h = 2.0*Circumradius(self.multimesh)
         h = (h('+') + h('-')) / 2
 
-        # Set parameters
-        alpha = 4.0
-        beta = 4.0
-        
         # Define bilinear form and linear form 
-        a = self.a_s(T,v)+self.a_N(T,v,n,h)+self.a_O(T,v)
-        
-        f = MultiMeshFunction(self.V)
-        f.interpolate(self.f)
-        L = self.l_s(f,v)
+        self.a = self.a_s(T,v)+self.a_N(T,v,n,h)+self.a_O(T,v)
+        self.f_h = MultiMeshFunction(self.V)
+        self.L = self.l_s(self.f_h,v)
+        self.bcs = [MultiMeshDirichletBC(self.V, Constant(0), mf_0, 1, 0)
+                    ,MultiMeshDirichletBC(self.V, Constant(1), mf_1, 2, 1)]
+        self.J_form = self.J_ufl(self.T)
+
+        # Adjoint equation
+        w = MultiMeshFunction(self.V)
+        L = self.J_ufl(self.T) + self.a_s(self.T,w)\
+            + self.a_N(self.T,w,n,h) + self.a_O(self.T,w) - self.l_s(self.f_h,w)
+        adjoint = derivative(L, self.T, TestFunction(self.V))
+        from ufl import replace
+        adjoint = replace(adjoint,  {w: TrialFunction(self.V)})
+        self.a_adj, self.L_adj = lhs(adjoint), rhs(adjoint)
+        self.bcs_adj = [MultiMeshDirichletBC(self.V, Constant(0), mf_0, 1, 0)
+                        ,MultiMeshDirichletBC(self.V, Constant(0), mf_1, 2, 1)]
+
+    def eval_J(self, angle):
+        """
+        Evaluates functional with object rotated at given angle
+        """
+        self.update_mesh(angle)
+        self.f_h.interpolate(self.f)
         
         # Deactivate hole in background mesh
-        self.multimesh.auto_cover(0, self.point)
+        with profiler.phase(AUTO_COVER):
+            self.multimesh.auto_cover(0, self.point)
 
         # Assemble linear system
-        A = assemble_multimesh(a)
-        b = assemble_multimesh(L)
-        bcs = [MultiMeshDirichletBC(self.V, Constant(0), mf_0, 1, 0)
-               ,MultiMeshDirichletBC(self.V, Constant(1), mf_1, 2, 1)]
-        [bc.apply(A,b) for bc in bcs]
+        with profiler.phase(ASSEMBLE):
+            A = assemble_multimesh(self.a)
+            b = assemble_multimesh(self.L)
+        with profiler.phase(BCS):
+            [bc.apply(A,b) for bc in self.bcs]
         
         # Solving linear system
-        self.V.lock_inactive_dofs(A, b)
-        solve(A, self.T.vector(), b,'lu')
-        self.out[0] << self.T.part(0)
-        self.out[1] << self.T.part(1)
+        with profiler.phase(LOCK):
+            self.V.lock_inactive_dofs(A, b)
+        with profiler.phase(SOLVE):
+            solve(A, self.T.vector(), b,'lu')
+        if self.save_output:
+            self.save_state()
 
          # Assemble functional value
-        return assemble_multimesh(self.J_ufl(self.T))
+        with profiler.phase(ASSEMBLE):
+            self.J = assemble_multimesh(self.J_form)
+        return self.J
+
+    def save_state(self):
+        """ Append state and rotated mesh to output/all_track.h5 """
+        if self.writer is None:
+            from hdf5_writer import TimeSeriesWriter
+            self.writer = TimeSeriesWriter("output/all_track.h5",
+                                           moving_parts=[1],
+                                           stride=self.output_stride)
+        with profiler.phase(IO):
+            self.writer.write([self.multimesh.part(0), self.multimesh.part(1)],
+                              {"T": [self.T.part(0), self.T.part(1)]})
 
 
     def eval_dJ(self, angle): # in degrees
@@ -139,66 +180,63 @@ class PoissonSolver():
 
         # Solve adjoint eq
         mf_0, mf_1 = self.mfs
-        f = MultiMeshFunction(self.V)
-        f.interpolate(self.f)
-        n = FacetNormal(self.multimesh)
-        h = 2.0*Circumradius(self.multimesh)
-        h = (h('+') + h('-')) / 2
-        v = MultiMeshFunction(self.V)
-        L = self.J_ufl(self.T) + self.a_s(self.T,v)\
-            + self.a_N(self.T,v,n,h) + self.a_O(self.T,v) - self.l_s(f,v)
-        adjoint = derivative(L, self.T, TestFunction(self.V))
-        from ufl import replace
-        adjoint = replace(adjoint,  {v: TrialFunction(self.V)})
-        a, L = lhs(adjoint), rhs(adjoint)
-        self.multimesh.build()
-        self.multimesh.auto_cover(0,self.point)
+        with profiler.phase(BUILD):
+            self.multimesh.build()
+        with profiler.phase(AUTO_COVER):
+            self.multimesh.auto_cover(0,self.point)
     
-        A = assemble_multimesh(a)
-        b = assemble_multimesh(L)
-        bcs = [MultiMeshDirichletBC(self.V, Constant(0), mf_0, 1, 0)
-               ,MultiMeshDirichletBC(self.V, Constant(0), mf_1, 2, 1)]
-        [bc.apply(A,b) for bc in bcs]
-        self.V.lock_inactive_dofs(A, b)
-        solve(A, self.lmb.vector(), b, 'lu')
+        with profiler.phase(ASSEMBLE):
+            A = assemble_multimesh(self.a_adj)
+            b = assemble_multimesh(self.L_adj)
+        with profiler.phase(BCS):
+            [bc.apply(A,b) for bc in self.bcs_adj]
+        with profiler.phase(LOCK):
+            self.V.lock_inactive_dofs(A, b)
+        with profiler.phase(SOLVE):
+            solve(A, self.lmb.vector(), b, 'lu')
 
         # Compute gradient
-        T1 = self.T.part(1, deepcopy=True)
-        lmb1 = self.lmb.part(1, deepcopy=True)
-        dS = Measure("ds", domain=self.multimesh.part(1), subdomain_data=mf_1)
-        
-        normal = FacetNormal(self.multimesh.part(1))
-        d = (0.5*T1*T1-dot(grad(lmb1),normal)*dot(grad(T1),normal))
-    
-        # Apply deformation s
-        dJs = assemble(inner(normal,self.s)*d*dS(2))
+        with profiler.phase(GRADIENT):
+            T1 = self.T.part(1, deepcopy=True)
+            lmb1 = self.lmb.part(1, deepcopy=True)
+            dS = Measure("ds", domain=self.multimesh.part(1),
+                         subdomain_data=mf_1)
+
+            normal = FacetNormal(self.multimesh.part(1))
+            d = (0.5*T1*T1-dot(grad(lmb1),normal)*dot(grad(T1),normal))
+
+            # Apply deformation s
+            dJs = assemble(inner(normal,self.s)*d*dS(2))
+        # The optimizers evaluate one gradient per iteration
+        profiler.next_iteration()
         return np.array([180./pi*dJs], dtype=float)
 
 
 
-def all_angles():
-    import numpy as np
-    delta = 0.3
-    N = int(360/delta)
-    angles = [delta*i for i in range(N)]
+def sweep_solver():
+    """
+    Create the solver used in the global sweep, without state output
+    """
     p = Point(1.25,0.875)
     m_names = ["meshes/multimesh_%d.xdmf" %i for i in range(2)]
     f_names = ["meshes/mf_%d.xdmf" %i for i in range(2)]
     fexp = Expression('x[0]*sin(x[0])*cos(x[1])', degree=4)
     solver = PoissonSolver(p, 0, m_names, f_names, fexp)
-    Js = []
-    dJds = []
-    out0 = File("output/T0_new.pvd")
-    out = File("output/T_new.pvd")
-    for theta in angles:
-        Js.append(solver.eval_J(theta))
-        dJds.append(solver.eval_dJ(theta))
-        out0 << solver.T.part(0)
-        out << solver.T.part(1)
+    solver.save_output = False
+    return solver
+
+def all_angles():
+    import numpy as np
+    from angle_sweep import sweep
+    delta = 0.3
+    N = int(360/delta)
+    angles = [delta*i for i in range(N)]
+    records = sweep(sweep_solver, angles, "results/Global_Dirichlet.npz")
+    Js = records["J"]
+    dJds = records["dJ"][:,0]
     print(angles[np.argmin(Js)], Js[np.argmin(Js)])
     print(angles[np.argmin(np.abs(dJds))], dJds[np.argmin(np.abs(dJds))])
 
-    np.savez("results/Global_Dirichlet.npz", deg=angles, J=Js)
     files = np.load("results/Global_Dirichlet.npz")
     fig = plt.figure()
     plt.plot(files["deg"], files["J"], '-',color=plt.cm.coolwarm(0), linewidth=4)
@@ -0,0 +1 @@
+../common/angle_sweep.py
\ No newline at end of file
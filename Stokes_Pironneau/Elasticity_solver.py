@@ -1,6 +1,8 @@
 from dolfin import *
+import numpy
 from IPython import embed
 from matplotlib.pyplot import show
+from profiler import profiler, ELASTICITY_ASSEMBLE, ELASTICITY_SOLVE
 
 def epsilon(u):
     """
@@ -15,7 +17,16 @@ class ElasticitySolver():
     See paper by Kutcha for information about this: 
     https://arxiv.org/pdf/1609.09425.pdf
     """
-    def __init__(self, mesh, facet_function, free_marker, deform_marker, constant_mu=True):
+    def __init__(self, mesh, facet_function, free_marker, deform_marker, constant_mu=True,
+                 max_growth=1.5):
+        """
+        The operator, rigid body null space and AMG preconditioner are kept
+        between solves. The operator and null space are only recomputed
+        when the mesh has moved. The AMG hierarchy is reused on moved
+        meshes until a solve needs more than max_growth times the CG
+        iterations of the first solve with the hierarchy, and is then
+        rebuilt at the next operator update.
+        """
         parameters["linear_algebra_backend"] = "PETSc"
         self.mesh = mesh
         self.mf = facet_function
@@ -32,7 +43,16 @@ class ElasticitySolver():
         self.compute_mu(constant_mu)
         
         self._sigma()
-        self.build_nullspace()
+        self.a = inner(self.sigma, grad(self.v))*dx
+        self.A = PETScMatrix()
+        self.b = Vector(MPI.comm_world, self.V.dim())
+        self.coordinates = None # Coordinates the operator was assembled at
+        self.max_growth = max_growth
+        self.base_iterations = None # Iterations of first solve with the AMG
+        self.rebuild = True # Build a new AMG hierarchy at next update
+        self.fresh = False # The AMG hierarchy has not been used yet
+        self.solver = PETScKrylovSolver("cg", "hypre_amg")
+        self.solver.parameters["monitor_convergence"] = 1==0
     
     def build_nullspace(self):
         """Function to build null space for 2D elasticity"""
@@ -104,31 +124,57 @@ class ElasticitySolver():
         self.sigma = 2*self.mu*epsilon(self.u) \
                      + self.lmb*tr(epsilon(self.u))*Identity(2)
 
+    def update_operator(self):
+        """
+        Reassemble the operator and null space if the mesh has moved since
+        the last solve, and rebuild the AMG hierarchy if it is stale.
+        The sparsity pattern is unchanged, so the operator is assembled
+        into the existing matrix.
+        """
+        coordinates = self.mesh.coordinates()
+        moved = (self.coordinates is None
+                 or not numpy.array_equal(coordinates, self.coordinates))
+        if not moved and not self.rebuild:
+            return
+        if moved:
+            assemble(self.a, tensor=self.A)
+            # The rotational rigid body mode depends on the coordinates
+            self.build_nullspace()
+            # Associate null space with A
+            self.A.set_nullspace(self.null_space)
+            self.A.set_near_nullspace(self.null_space)
+
+        # Keep the AMG hierarchy of a previous mesh as preconditioner,
+        # unless the iteration count has shown that it is stale
+        self.solver.set_reuse_preconditioner(not self.rebuild)
+        self.fresh = self.rebuild
+        self.rebuild = False
+        self.solver.set_operator(self.A)
+        self.coordinates = coordinates.copy()
+
     def solve(self, f, h):
         self.set_volume_forces(f)
         self.set_boundary_stress(h, self.deform_marker)
-        a = inner(self.sigma, grad(self.v))*dx
         L = inner(self.f,self.v)*dx + inner(self.h,self.v)*self.dstress
 
-        # Assemble system
-        A = assemble(a)
-        b = Vector(MPI.comm_world, self.V.dim())
-        assemble(L, tensor=b)
-
-        # Associate null space with A
-        as_backend_type(A).set_nullspace(self.null_space)
-        as_backend_type(A).set_near_nullspace(self.null_space)
+        # Assemble system, only the load changes if the mesh has not moved
+        # The phases are kept apart from the ones of the flow solvers
+        with profiler.phase(ELASTICITY_ASSEMBLE):
+            self.update_operator()
+            assemble(L, tensor=self.b)
 
         # Orthogonalize right-hand side to make sure that input is in the
         # range of A aka the orthogonal complement of the null space, cf.
         # linear algebra 101.
-        self.null_space.orthogonalize(b)
-
-        # Define solver, set operator and set nullspace
-        solver = PETScKrylovSolver("cg", "hypre_amg")
-        solver.parameters["monitor_convergence"] = 1==0
-        solver.set_operator(A)
-        solver.solve(self.u_.vector(), b)
+        self.null_space.orthogonalize(self.b)
+
+        with profiler.phase(ELASTICITY_SOLVE):
+            iterations = self.solver.solve(self.u_.vector(), self.b)
+        if self.fresh:
+            self.base_iterations = max(iterations, 1)
+            self.fresh = False
+        elif iterations > self.max_growth*self.base_iterations:
+            self.rebuild = True
         # plot(self.u_)
         # show()
 
@@ -18,10 +18,16 @@ from IPython import embed
 from pdb import set_trace
 import matplotlib.pyplot as plt
 import moola
+from mixed_split import MixedSplitter
+from geometry import ObstacleGeometry
+from profiler import profiler, BUILD, AUTO_COVER, FORMS, ASSEMBLE, BCS, LOCK,\
+    FACTORIZE, SOLVE, GRADIENT, IO
 set_log_level(LogLevel.ERROR)
 class StokesSolver():
     def __init__(self, meshes, facetfunctions, cover_points,
-                 bc_dict, move_dict, length_width):
+                 bc_dict, move_dict, length_width,
+                 linear_solver="mumps", krylov_rtol=1e-10,
+                 krylov_max_it=1000):
         """
         Solve the stokes problem with multiple meshes.
         Arguments:
@@ -39,6 +45,12 @@ class StokesSolver():
            length_width: List containing the length and width of channel
                    without an obstacle. Needed to compute barycenter of 
                    obstacle
+           linear_solver: "mumps" for a direct solve, or "gmres". GMRES
+                   is preconditioned with an additive fieldsplit, with AMG
+                   on the velocity operator and Jacobi on the pressure
+                   mass matrix
+           krylov_rtol: Relative tolerance of the Krylov solver
+           krylov_max_it: Maximal number of Krylov iterations
         """
         self.__init_multimesh(meshes, cover_points)
         self.mfs = facetfunctions
@@ -52,19 +64,23 @@ class StokesSolver():
         self.w = MultiMeshFunction(self.VQ, name="State")
         self.u = MultiMeshFunction(V, name="u")
         self.p = MultiMeshFunction(Q, name="p")
+        self.splitter = MixedSplitter(self.VQ, V, Q)
 
         self.f = Constant([0.]*self.multimesh.part(0).geometric_dimension())
+        self.__init_forms()
+        self.__init_linear_solver(linear_solver, krylov_rtol, krylov_max_it)
         self.N = len(meshes)
         self.backup = [self.multimesh.part(i).coordinates().copy() for i in range(1,self.N)]
 
-        self.outu = [File("output/u_%d.pvd" %i) for i in range(self.N)]
-        self.outp = [File("output/p_%d.pvd" %i) for i in range(self.N)]
+        self.writer = None # Created at first save_state
+        self.output_stride = 1 # Write every output_stride-th state
         self.J = 0
         self.dJ = 0
         self.opt_it = 0
         self.vfac = 5e4
         self.bfac = 5e4
         self.length_width = length_width
+        self.e_solvers = None # Mesh deformation solver for each moving part
         self.__init_geometric_quantities()
         
         
@@ -76,9 +92,11 @@ class StokesSolver():
             multimesh.add(mesh)
             self.backup.append(mesh.coordinates().copy())
             self.S.append(VectorFunctionSpace(mesh, "CG", 1))
-        multimesh.build()
-        for key in cover_points.keys():
-            multimesh.auto_cover(key, cover_points[key])            
+        with profiler.phase(BUILD):
+            multimesh.build()
+        with profiler.phase(AUTO_COVER):
+            for key in cover_points.keys():
+                multimesh.auto_cover(key, cover_points[key])
         self.multimesh = multimesh
         self.cover_points = cover_points
 
@@ -94,47 +112,96 @@ class StokesSolver():
                                           self.mfs[i], marker, i)
                 self.bcs.append(bc)
 
+    @profiler.timed(FORMS)
+    def __init_forms(self):
+        """
+        Create the bilinear and linear form of the Stokes problem.
+        The forms only depend on the multimesh through the facet normal
+        and the circumradius, which are evaluated at assembly time, so
+        they can be reused after the multimesh has been rebuilt.
+        """
+        (u, p) = TrialFunctions(self.VQ)
+        (v, q) = TestFunctions(self.VQ)
+        n = FacetNormal(self.multimesh)
+        h = 2.0*Circumradius(self.multimesh)
+        alpha = Constant(6.0)
+        
+        tensor_jump = lambda u: outer(u("+"), n("+")) + outer(u("-"), n("-"))
+
+        a_s = inner(grad(u), grad(v))*dX
+        a_IP = - inner(avg(grad(u)), tensor_jump(v))*dI\
+               - inner(avg(grad(v)), tensor_jump(u))*dI\
+               + alpha/avg(h) * inner(jump(u), jump(v))*dI
+        a_O = inner(jump(grad(u)), jump(grad(v)))*dO
+
+        b_s = -div(u)*q*dX - div(v)*p*dX
+        b_IP = jump(u, n)*avg(q)*dI + jump(v, n)*avg(p)*dI
+        l_s = inner(self.f, v)*dX
+
+        s_C = h*h*inner(-div(grad(u)) + grad(p), -div(grad(v)) - grad(q))*dC\
+              + h("+")*h("+")*inner(-div(grad(u("+"))) + grad(p("+")),
+                                    -div(grad(v("+"))) + grad(q("+")))*dO
+        l_C = h*h*inner(self.f, -div(grad(v)) - grad(q))*dC\
+              + h("+")*h("+")*inner(self.f("+"),
+                                    -div(grad(v("+"))) - grad(q("+")))*dO
+        
+        self.a = a_s + a_IP + a_O + b_s + b_IP + s_C
+        self.l = l_s + l_C
+        # Block diagonal preconditioner matrix, velocity block and pressure
+        # mass matrix as approximation of the Schur complement, split into
+        # the two fields by the Krylov solver
+        self.a_P = a_s + a_IP + a_O + p*q*dX
+
+    def __init_linear_solver(self, linear_solver, rtol, max_it):
+        """
+        Create the Krylov solver used if the direct solver is not chosen.
+        The solver starts from the current state, which is the solution
+        of the previous optimization iteration.
+        """
+        self.linear_solver = linear_solver
+        if linear_solver == "mumps":
+            self.krylov = None
+            return
+        # The stabilization s_C makes the system non-symmetric, so MINRES
+        # and CG are not applicable
+        if linear_solver != "gmres":
+            raise ValueError("Unsupported linear solver %s, use \"mumps\" "
+                             "or \"gmres\"" % linear_solver)
+        from stokes_fieldsplit import StokesFieldSplit
+        self.krylov = StokesFieldSplit(self.VQ, self.splitter, self.a_P,
+                                       self.bcs, rtol, max_it)
+
     def __init_geometric_quantities(self):
         """
         Helper initializer to compute original volume and barycenter
         of the obstacle.
         """
-        x = SpatialCoordinate(self.multimesh)
-        V = MultiMeshFunctionSpace(self.multimesh, "CG", 1)
-        x = interpolate(Expression("x[0]", degree=1), V)
-        y = interpolate(Expression("x[1]", degree=1), V)
-        fluid_vol = assemble_multimesh(Constant(1)*dx(domain=self.multimesh) +
-                                       Constant(1)*dC(domain=self.multimesh))
-        self.Vol0 = Constant(self.length_width[0]*self.length_width[1]
-                                 - fluid_vol)
-        self.bx0 = Constant((0.5*self.length_width[0]
-                             - assemble_multimesh(x*dX))/self.Vol0)
-        self.by0 = Constant((0.5*self.length_width[1]
-                             - assemble_multimesh(y*dX))/self.Vol0)
+        # A single obstacle is measured exactly from its boundary
+        obstacle = None
+        if self.N == 2:
+            obstacle = (1, self.mfs[1], self.move_dict[1]["Deform"])
+        self.geometry = ObstacleGeometry(self.multimesh, self.length_width,
+                                         obstacle=obstacle)
+        Vol0, bx0, by0 = self.geometry.quantities()
+        self.Vol0 = Constant(Vol0)
+        self.bx0 = Constant(bx0)
+        self.by0 = Constant(by0)
 
-    
     def geometric_quantities(self):
         """
         Compute volume and  barycenter of obstacle, as long as its 
         offset from original values with current multimesh
         """
-        x = SpatialCoordinate(self.multimesh)
-        V = MultiMeshFunctionSpace(self.multimesh, "CG", 1)
-        x = interpolate(Expression("x[0]", degree=1), V)
-        y = interpolate(Expression("x[1]", degree=1), V)
-        fluid_vol = assemble_multimesh(Constant(1)*dx(domain=self.multimesh) +
-                                       Constant(1)*dC(domain=self.multimesh))
-        self.Vol = Constant(self.length_width[0]*self.length_width[1]
-                             - fluid_vol)
-        self.bx = Constant((0.5*self.length_width[0]
-                            - assemble_multimesh(x*dX))/self.Vol)
-        self.by = Constant((0.5*self.length_width[1]
-                            - assemble_multimesh(y*dX))/self.Vol)
+        Vol, bx, by = self.geometry.quantities()
+        self.Vol = Constant(Vol)
+        self.bx = Constant(bx)
+        self.by = Constant(by)
         self.Voloff = self.Vol - self.Vol0
         self.bxoff = self.bx - self.bx0
         self.byoff = self.by - self.by0
 
 
+    @profiler.timed(GRADIENT)
     def recompute_dJ(self):
         """
         Create gradient expression for deformation algorithm
@@ -166,7 +233,8 @@ class StokesSolver():
 
     def eval_J(self):
         self.geometric_quantities()
-        J_s = assemble_multimesh(inner(grad(self.u),grad(self.u))*dX)
+        with profiler.phase(ASSEMBLE):
+            J_s = assemble_multimesh(inner(grad(self.u),grad(self.u))*dX)
         J_v = self.vfac*self.Voloff**2
         J_bx = self.bfac*self.bxoff**2
         J_by = self.bfac*self.byoff**2
@@ -176,75 +244,80 @@ class StokesSolver():
         """
         Solves the stokes equation with the current multimesh
         """
-        (u, p) = TrialFunctions(self.VQ)
-        (v, q) = TestFunctions(self.VQ)
-        n = FacetNormal(self.multimesh)
-        h = 2.0*Circumradius(self.multimesh)
-        alpha = Constant(6.0)
-        
-        tensor_jump = lambda u: outer(u("+"), n("+")) + outer(u("-"), n("-"))
-
-        a_s = inner(grad(u), grad(v))*dX
-        a_IP = - inner(avg(grad(u)), tensor_jump(v))*dI\
-               - inner(avg(grad(v)), tensor_jump(u))*dI\
-               + alpha/avg(h) * inner(jump(u), jump(v))*dI
-        a_O = inner(jump(grad(u)), jump(grad(v)))*dO
-
-        b_s = -div(u)*q*dX - div(v)*p*dX
-        b_IP = jump(u, n)*avg(q)*dI + jump(v, n)*avg(p)*dI
-        l_s = inner(self.f, v)*dX
-
-        s_C = h*h*inner(-div(grad(u)) + grad(p), -div(grad(v)) - grad(q))*dC\
-              + h("+")*h("+")*inner(-div(grad(u("+"))) + grad(p("+")),
-                                    -div(grad(v("+"))) + grad(q("+")))*dO
-        l_C = h*h*inner(self.f, -div(grad(v)) - grad(q))*dC\
-              + h("+")*h("+")*inner(self.f("+"),
-                                    -div(grad(v("+"))) - grad(q("+")))*dO
-        
-        a = a_s + a_IP + a_O + b_s + b_IP + s_C
-        l = l_s + l_C
-
-        A = assemble_multimesh(a)
-        L = assemble_multimesh(l)
-        [bc.apply(A, L) for bc in self.bcs]
-        self.VQ.lock_inactive_dofs(A, L)
-        solve(A, self.w.vector(), L, "mumps")
+        with profiler.phase(ASSEMBLE):
+            A = assemble_multimesh(self.a)
+            L = assemble_multimesh(self.l)
+        with profiler.phase(BCS):
+            [bc.apply(A, L) for bc in self.bcs]
+        with profiler.phase(LOCK):
+            self.VQ.lock_inactive_dofs(A, L)
+        self.solve_system(A, L)
         self.splitMMF()
 
+    def solve_system(self, A, L):
+        """
+        Solve the locked Stokes system, with MUMPS or the preconditioned
+        Krylov solver
+        """
+        if self.krylov is None:
+            # Each system is solved once, and MUMPS factorizes and solves
+            # in the same call, dominated by the factorization
+            with profiler.phase(FACTORIZE):
+                solve(A, self.w.vector(), L, "mumps")
+            return
+        # The preconditioner is assembled once per geometry, while the AMG
+        # hierarchy of the velocity split is built by PETSc inside the
+        # Krylov solve
+        with profiler.phase(FACTORIZE):
+            self.krylov.set_operator(A, L)
+        with profiler.phase(SOLVE):
+            self.krylov.solve(self.w.vector(), L)
+
     def splitMMF(self):
         """
         Split a mixed multimeshfunction into separate multimeshfunctions
         """
-        for i in range(self.multimesh.num_parts()):
-            Vi = FunctionSpace(self.multimesh.part(i), self.V2)
-            Pi = FunctionSpace(self.multimesh.part(i), self.S1)
-            ui, pi = self.w.part(i, deepcopy=True).split()
-
-            self.u.assign_part(i, interpolate(ui,Vi))
-            self.p.assign_part(i, interpolate(pi,Pi))
+        self.splitter.split(self.w, self.u, self.p)
 
     def save_state(self):
         """
-        Save current velocity and pressure to file
+        Append current velocity, pressure and obstacle meshes to
+        output/state.h5
         """
-        for i in range(self.multimesh.num_parts()):
-            self.outu[i] << self.u.part(i,deepcopy=True)
-            self.outp[i] << self.p.part(i,deepcopy=True)
+        if self.writer is None:
+            from hdf5_writer import TimeSeriesWriter
+            self.writer = TimeSeriesWriter("output/state.h5",
+                                           moving_parts=range(1, self.N),
+                                           stride=self.output_stride)
+        parts = range(self.multimesh.num_parts())
+        with profiler.phase(IO):
+            self.writer.write([self.multimesh.part(i) for i in parts],
+                              {"u": [self.u.part(i, deepcopy=True)
+                                     for i in parts],
+                               "p": [self.p.part(i, deepcopy=True)
+                                     for i in parts]},
+                              t=self.opt_it)
 
     def generate_mesh_deformation(self):
         """
         Generates an linear elastic mesh deformation using the steepest
         gradient as stress on the boundary.
+        The elasticity solvers are created at the first call and kept,
+        as the topology of the moving meshes never changes.
         """
         from Elasticity_solver import ElasticitySolver
+        if self.e_solvers is None:
+            self.e_solvers = [ElasticitySolver(self.multimesh.part(i),
+                                               self.mfs[i],
+                                    free_marker=self.move_dict[i]["Free"],
+                                    deform_marker=self.move_dict[i]["Deform"],
+                                               constant_mu=True)
+                              for i in range(1, self.N)]
         self.deformation = []
         for i in range(1, self.N):
-            e_solver = ElasticitySolver(self.multimesh.part(i), self.mfs[i],
-                                      free_marker=self.move_dict[i]["Free"],
-                                      deform_marker=self.move_dict[i]["Deform"],
-                                        constant_mu=True)
+            e_solver = self.e_solvers[i-1]
             e_solver.solve(self.f, -self.integrand_list[i-1])
-            self.deformation.append(e_solver.u_)
+            self.deformation.append(e_solver.u_.copy(deepcopy=True))
 
     def generate_H1_deformation(self):
         self.deformation = []
@@ -273,6 +346,35 @@ class StokesSolver():
         for i in range(1,self.N):
             self.backup[i-1] = self.multimesh.part(i).coordinates().copy()
 
+    def save_restart(self, filename, **driver_state):
+        """
+        Save the coordinates of the moving meshes, penalty factors and
+        current state to a binary checkpoint, together with the driver state
+        """
+        from restart import save_restart
+        save_restart(filename, [self.multimesh.part(i) for i in range(self.N)],
+                     self.w, vfac=self.vfac, bfac=self.bfac,
+                     opt_it=self.opt_it, **driver_state)
+
+    def load_restart(self, filename):
+        """
+        Resume from a checkpoint written by save_restart. The stored state
+        is the initial guess of the next solve. Returns the driver state.
+        """
+        from restart import load_restart
+        state = load_restart(filename,
+                             [self.multimesh.part(i) for i in range(self.N)],
+                             self.w)
+        self.vfac = float(state.pop("vfac"))
+        self.bfac = float(state.pop("bfac"))
+        self.opt_it = int(state.pop("opt_it"))
+        self.set_checkpoint()
+        self.multimesh.build()
+        for key in self.cover_points.keys():
+            self.multimesh.auto_cover(key, self.cover_points[key])
+        self.splitMMF()
+        return state
+
     def update_multimesh(self,step):
         move_norm = []
         hmins = []
@@ -295,9 +397,11 @@ class StokesSolver():
         self.move_norm = sqrt(sum(move_norm))
         # self.move_max = max(move_max)
         # print(hmins, move_max)
-        self.multimesh.build()
-        for key in self.cover_points.keys():
-            self.multimesh.auto_cover(key, self.cover_points[key])
+        with profiler.phase(BUILD):
+            self.multimesh.build()
+        with profiler.phase(AUTO_COVER):
+            for key in self.cover_points.keys():
+                self.multimesh.auto_cover(key, self.cover_points[key])
 
 if __name__ == "__main__":
     meshes = []
@@ -326,7 +430,13 @@ if __name__ == "__main__":
 
     markers = ["o","v","s","P","*","d"]
     colors = ["b","r","g","k","m"]
-    def steepest_descent():
+    def steepest_descent(restart_file="output/steepest_restart.npz",
+                         restart=False):
+        """
+        Steepest descent with Armijo linesearch. A checkpoint is written to
+        restart_file after every accepted step, and if restart is True the
+        optimization continues from it.
+        """
         o_u = [File("output/u_mesh%d.pvd" %i) for i in range(solver.N)]
         search = moola.linesearch.ArmijoLineSearch(start_stp=1)
         outmesh = File("output/steepest.pvd")
@@ -336,6 +446,11 @@ if __name__ == "__main__":
 
         opts = 0
         rel_tol = 1e-4
+        if restart:
+            state = solver.load_restart(restart_file)
+            search.start_stp = float(state["start_stp"])
+            opts = int(state["opts"])
+            print("Restarting from iteration {0:d}".format(int(state["i"])))
         solver.solve()
         solver.eval_J()
         plot(solver.multimesh.part(1), color=colors[0],linewidth=0.75,zorder=0)
@@ -346,7 +461,12 @@ if __name__ == "__main__":
         J_it = [solver.J]
         J_i = J_it[0]
         i = 1
+        if restart:
+            J_it = list(state["J_it"])
+            J_i = float(state["J_i"])
+            i = int(state["i"])
         while i<=max_it:
+            profiler.next_iteration()
             outmesh << solver.multimesh.part(1)
             for k in range(solver.N):
                 o_u[k] << solver.u.part(k)
@@ -411,6 +531,9 @@ if __name__ == "__main__":
 
                     i+=1
                     search.start_stp=1
+                    solver.save_restart(restart_file, i=i, opts=opts,
+                                        start_stp=search.start_stp,
+                                        J_it=J_it, J_i=J_i)
                 else:
                     # If Armjio linesearch returns an unfeasible
                     # functional value, literally deforming too much.
@@ -476,5 +599,9 @@ if __name__ == "__main__":
         plt.savefig("StokesRugbyMeshes.png",dpi=300)
         import os
         os.system("convert StokesRugbyMeshes.png -trim StokesRugbyMeshes.png")
-    steepest_descent()
+        profiler.report()
+        profiler.write_json("output/steepest_timings.json")
+        profiler.write_csv("output/steepest_timings.csv")
+    import sys
+    steepest_descent(restart="--restart" in sys.argv)
     
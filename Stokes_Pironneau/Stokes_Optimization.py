@@ -29,10 +29,20 @@ from matplotlib.pyplot import show
 import matplotlib as mpl
 from dolfin import *
 import moola
+from active_dofs import ActiveDofMask
+from mixed_split import MixedSplitter
+from geometry import ObstacleGeometry
+from facet_markers import FacetMarkerStore
+from create_meshes import inner_marker, outer_marker, L as length, H as width
+from profiler import profiler, BUILD, AUTO_COVER, ASSEMBLE, BCS, LOCK,\
+    FACTORIZE, IO, DEFORM, GEOMETRY, CVT
 from IPython import embed
 from pdb import set_trace
 set_log_level(40)
 
+# Channel dimensions, as used for the meshes
+length_width = [length, width]
+
 """
 Stokes Solver for multimesh problem, with option of having solution saved as output.
    Input:
@@ -40,25 +50,17 @@ Stokes Solver for multimesh problem, with option of having solution saved as out
                      (mesh_0) with a hole where mesh_1 should be. mesh_1 should
                      have overlapping outer boundaries, while the inner boundary
                      is the flow obstacle.
-         out       - A dictionary containing global the functionspace, solution
-                     function and output files.
+         state     - MultiMeshState of the multimesh, with the function space,
+                     solution function and facet functions.
    Output:
          u,p       - MultiMeshFunctions containing velocity and pressure solutions of the stokes equation
 """
-def StokesSolve(multimesh, out=None):
-    if out==None:
-        # Define Finite Element-spaces if this is a Armijo-linesearch.
-        V2 = VectorElement("CG", triangle, 2)
-        S1 = FiniteElement("CG", triangle, 1)
-        TH = V2 * S1
-        VQ = MultiMeshFunctionSpace(multimesh, TH)
-        w = MultiMeshFunction(VQ)
-    else:
-        # Use Global spaces if this is a standard call
-        VQ = out["VQ"]
-        w = out["w"]
+def StokesSolve(state):
+    multimesh = state.multimesh
+    VQ = state.VQ
+    w = state.w
 
-    [mf_0, mf_1] = load_facet_function(multimesh)
+    [mf_0, mf_1] = state.mfs
     
     # Define trial and test functions
     (u, p) = TrialFunctions(VQ)
@@ -74,8 +76,10 @@ def StokesSolve(multimesh, out=None):
         + s_C(u, p, v, q, h)
     L  = l_h(v, q, f) + l_C(v, q, f, h)
 
-    multimesh.build()
-    multimesh.auto_cover(0, Point(0.5,0.5))
+    with profiler.phase(BUILD):
+        multimesh.build()
+    with profiler.phase(AUTO_COVER):
+        multimesh.auto_cover(0, Point(0.5,0.5))
 
     # Create boundary conditions
     inflow_value = Expression(("1.0", "0.0"),degree=1)
@@ -91,19 +95,19 @@ def StokesSolve(multimesh, out=None):
     bcs = [bc0, bc1, bc3]
 
     # Assemble linear system, apply boundary conditions and solve
-    assemble_time = -time.time()
-    A = assemble_multimesh(a)
-    b = assemble_multimesh(L)
-    assemble_time += time.time()
-    [bc.apply(A, b) for bc in bcs]
-    VQ.lock_inactive_dofs(A, b)
-    solve_time = -time.time()
-    solve(A, w.vector(), b, "mumps")
-    solve_time += time.time()
-    print("Assemble time: %.2e" % assemble_time)
-    print("Solve time: %.2e" % solve_time)
+    with profiler.phase(ASSEMBLE):
+        A = assemble_multimesh(a)
+        b = assemble_multimesh(L)
+    with profiler.phase(BCS):
+        [bc.apply(A, b) for bc in bcs]
+    with profiler.phase(LOCK):
+        VQ.lock_inactive_dofs(A, b)
+    # MUMPS factorizes and solves in one call, dominated by the
+    # factorization, as in StokesSolver
+    with profiler.phase(FACTORIZE):
+        solve(A, w.vector(), b, "mumps")
     # Splitting the mixed-multimeshfunction
-    u, p = splitMMF(w, multimesh)
+    u, p = splitMMF(w, state.splitter)
     return u, p
 
 
@@ -156,13 +160,9 @@ def vector_norm(f):
     return f_x
 
 def load_facet_function(multimesh):
-    mfs = []
-    for i in range(multimesh.num_parts()):
-        mvc = MeshValueCollection("size_t", multimesh.part(i), 1)
-        with XDMFFile("meshes/mf_%d.xdmf" %i) as infile:
-            infile.read(mvc, "name_to_read")
-        mfs.append(cpp.mesh.MeshFunctionSizet(multimesh.part(i), mvc))
-    return mfs
+    # Read from file at the first call only
+    return facet_markers.load(multimesh)
+facet_markers = FacetMarkerStore("meshes/mf_%d.xdmf")
 
 def Laplacian(mesh, mf_1, n, step, direction, alpha=1e-2):
     # Smoothed H1 representation
@@ -213,92 +213,72 @@ def a_h(v, w, n, h,  alpha=6.0): # FIXME: alpha=2,4. does not work,works: 6,10.
 """
 Returns the deformed mesh after getting gradient information
 Input:
-      omega - The inital mesh
-      mf - MeshFunction with boundaries 
-      gradient - gradient of functional in descent direction
+      state - MultiMeshState of the inital mesh
       step - Step-lenght of scheme
-      laplace - Type of deformation scheme
+      trial - MultiMeshState of the line-search trial steps. If given, it
+              is reset to state and deformed, and state is kept unchanged
 Output:
-      omega - The deformed mesh
+      state - MultiMeshState of the deformed mesh
+      w1 - The deformation
 """
-def deform_mesh(multimesh_o, step, forget=False, vfac=Constant(1),
+def deform_mesh(state, step, trial=None, vfac=Constant(1),
                 bfac=Constant(1),cvt=None):
-    if forget:
-        multimesh = MultiMesh()
-        multimesh.add(Mesh(multimesh_o.part(0)))
-        multimesh.add(Mesh(multimesh_o.part(1)))
-        multimesh.build()
-
-    else:
-        multimesh = multimesh_o
+    if trial is not None:
+        trial.reset(state)
+        state = trial
+    multimesh = state.multimesh
 
     V2 = VectorElement("CG", triangle, 2)
     Vdrag0 = FunctionSpace(multimesh.part(0), V2)
     Vdrag1 = FunctionSpace(multimesh.part(1), V2)
     Vdrag = MultiMeshFunctionSpace(multimesh, V2)
 
-    u, p = StokesSolve(multimesh)
-    gradient = functional_gradient(u, multimesh, Vol0, bx0, by0,vfac=vfac,
+    u, p = StokesSolve(state)
+    gradient = functional_gradient(u, state, Vol0, bx0, by0,vfac=vfac,
                                    bfac=bfac)
-    mf_0, mf_1 = load_facet_function(multimesh)
+    mf_0, mf_1 = state.mfs
     
     from femorph import VolumeNormal
     normal = VolumeNormal(multimesh.part(1), [0], mf_1)
 
-    deform_time = -time.time()
     #direction = -gradient   
     # w1 =  Laplacian(multimesh.part(1), mf_1, normal, step, direction,
     #               alpha=5e-1)
     direction = -step*gradient*normal
-    from Elasticity_solver import ElasticitySolver
-    e_solve = ElasticitySolver(multimesh.part(1), mf_1)
-    e_solve.solve(Constant((0,0)), direction, 2)
-    w1 = e_solve.u_
-    ALE.move(multimesh.part(1), w1)
-    deform_time += time.time()
-    print("Deformation time: %.2e" % deform_time)
-    multimesh.build()
-    return multimesh, w1
+    e_solve = state.deformation_solver()
+    e_solve.solve(Constant((0,0)), direction)
+    w1 = e_solve.u_.copy(deepcopy=True)
+    with profiler.phase(DEFORM):
+        ALE.move(multimesh.part(1), w1)
+    with profiler.phase(BUILD):
+        multimesh.build()
+    return state, w1
 
 """
 Returns volume, baricenter of of a multimesh
 Input:
-      omega - The inital multimeshmesh
+      state - MultiMeshState of the multimesh
 Output:
       Vol - Volume of multimesh
       bx,by - baricenter of multimesh
 """
-def geometric_quantities(multimesh):
-    mesh_time = -time.time()
-    multimesh.build()
-    multimesh.auto_cover(0, Point(0.5,0.5))
-
-    mesh_time += time.time()
-    print("Build and cover %.2e" % (mesh_time))
-    x = SpatialCoordinate(multimesh)
-    V = MultiMeshFunctionSpace(multimesh, "CG", 1)
-    x0 = interpolate(Expression("x[0]", degree=1), V)
-    x1 = interpolate(Expression("x[1]", degree=1), V)
-    VolOmega = assemble_multimesh(1*dx(domain=multimesh)+1*dC(domain=multimesh))
-    Vol = Constant(1 - VolOmega)
-    # FIXME, Should be able to do something like
-    # assemble_multimesh(x[0]*dx(domain=multimesh))
-    bx = Constant((Constant(1./2)-assemble_multimesh(x0*dX))/Vol)
-    by = Constant((Constant(1./2)-assemble_multimesh(x1*dX))/Vol)
-    return Vol, bx, by
+def geometric_quantities(state):
+    with profiler.phase(GEOMETRY):
+        Vol, bx, by = state.geometry.quantities()
+    return Constant(Vol), Constant(bx), Constant(by)
 
 """
 Returns the functional value for a given mesh
 Input:
       u - Solution of Stokes eq
-      omega - MultiMesh for stokes-solution
+      state - MultiMeshState of the stokes-solution
       Vol0, bx0, by0 - Goal quantites for volume and baricenter
       vfac, bfac - Penalty parameters for volume and baricenter
 Output:
      J - Functional value at given point in space
 """
-def functional(u, multimesh, Vol0, bx0, by0, vfac=Constant(1e5), bfac=Constant(1e3)):
-    Vol, bx, by = geometric_quantities(multimesh)
+def functional(u, state, Vol0, bx0, by0, vfac=Constant(1e5), bfac=Constant(1e3)):
+    Vol, bx, by = geometric_quantities(state)
     vol_off = Vol-Vol0
     bx_off, by_off = bx-bx0, by-by0
     J_s = assemble_multimesh(inner(grad(u),grad(u))*dX)
@@ -307,11 +287,11 @@ def functional(u, multimesh, Vol0, bx0, by0, vfac=Constant(1e5), bfac=Constant(1
     J = J_s + J_v + J_c
     return J
 
-def functional_gradient(u, multimesh, Vol0, bx0, by0, vfac=Constant(1e5),
+def functional_gradient(u, state, Vol0, bx0, by0, vfac=Constant(1e5),
                         bfac=Constant(1e3)):
-    x = SpatialCoordinate(multimesh.part(1))
+    x = SpatialCoordinate(state.multimesh.part(1))
     u_1 = u.part(1, deepcopy=True)
-    Vol, bx, by = geometric_quantities(multimesh)
+    Vol, bx, by = geometric_quantities(state)
     vol_off = Vol-Vol0
     bx_off, by_off = bx-bx0, by-by0
     stokes = -inner(grad(u_1), grad(u_1))
@@ -319,24 +299,73 @@ def functional_gradient(u, multimesh, Vol0, bx0, by0, vfac=Constant(1e5),
     bar = Constant(2.)*bfac/Vol*((bx-x[0])*bx_off + (by-x[1])*by_off)
     return stokes+vol+bar
 
-def splitMMF(w,multimesh):
+def splitMMF(w, splitter):
+    """
+    Split the mixed MultiMeshFunction w into velocity and pressure, with
+    the splitter of the function space of w
+    """
+    umm = MultiMeshFunction(splitter.V)
+    pmm = MultiMeshFunction(splitter.Q)
+    splitter.split(w, umm, pmm)
+    return umm,pmm
+
+def mixed_splitter(VQ):
+    multimesh = VQ.multimesh()
     V2 = VectorElement("CG", triangle, 2)
     S1 = FiniteElement("CG", triangle, 1)
-    V0 = FunctionSpace(multimesh.part(0), V2)
-    V1 = FunctionSpace(multimesh.part(1), V2)
-    Vmm = MultiMeshFunctionSpace(multimesh, V2)
-    P0 = FunctionSpace(multimesh.part(0), S1)
-    P1 = FunctionSpace(multimesh.part(1), S1)
-    Pmm = MultiMeshFunctionSpace(multimesh, S1)
-    u0, p0 = w.part(0, deepcopy=True).split()
-    u1, p1 = w.part(1, deepcopy=True).split()
-    umm = MultiMeshFunction(Vmm)
-    pmm = MultiMeshFunction(Pmm)
-    umm.assign_part(0, interpolate(u0,V0))
-    umm.assign_part(1, interpolate(u1,V1))
-    pmm.assign_part(0, interpolate(p0,P0))
-    pmm.assign_part(1, interpolate(p1,P1))
-    return umm,pmm
+    return MixedSplitter(VQ, MultiMeshFunctionSpace(multimesh, V2),
+                         MultiMeshFunctionSpace(multimesh, S1))
+
+class MultiMeshState():
+    """
+    A multimesh with the spaces, state, facet functions, obstacle geometry
+    and deformation solver built on it. The driver keeps one state for the
+    iterate and one for the line-search trial steps, such that all of them
+    are created once and reused between steps, as the topology of the
+    parts never changes.
+    """
+    def __init__(self, multimesh):
+        self.multimesh = multimesh
+        V2 = VectorElement("CG", triangle, 2)
+        S1 = FiniteElement("CG", triangle, 1)
+        self.VQ = MultiMeshFunctionSpace(multimesh, V2 * S1)
+        self.w = MultiMeshFunction(self.VQ)
+        self.splitter = mixed_splitter(self.VQ)
+        self.mfs = load_facet_function(multimesh)
+        self.geometry = ObstacleGeometry(multimesh, length_width,
+                                         obstacle=(1, self.mfs[1],
+                                                   inner_marker))
+        self.e_solver = None # Created at the first deformation
+
+    @classmethod
+    def copy(cls, state):
+        """ State on copies of the meshes of state, such as a trial step """
+        multimesh = MultiMesh()
+        for i in range(state.multimesh.num_parts()):
+            multimesh.add(Mesh(state.multimesh.part(i)))
+        multimesh.build()
+        return cls(multimesh)
+
+    def reset(self, state):
+        """ Move the meshes back to the coordinates of the meshes of state """
+        for i in range(state.multimesh.num_parts()):
+            self.multimesh.part(i).coordinates()[:] = \
+                state.multimesh.part(i).coordinates()
+        with profiler.phase(BUILD):
+            self.multimesh.build()
+
+    def deformation_solver(self):
+        """
+        Elasticity solver deforming the obstacle mesh. The mesh object is
+        kept, so the operator and AMG hierarchy are kept between steps.
+        """
+        if self.e_solver is None:
+            from Elasticity_solver import ElasticitySolver
+            self.e_solver = ElasticitySolver(self.multimesh.part(1),
+                                             self.mfs[1],
+                                             free_marker=outer_marker,
+                                             deform_marker=inner_marker)
+        return self.e_solver
 
 if __name__ == "__main__":
     import sys
@@ -368,18 +397,19 @@ if __name__ == "__main__":
     multimesh.build()
             
 
-    V2 = VectorElement("CG", triangle, 2)
-    S1 = FiniteElement("CG", triangle, 1)
-    TH = V2 * S1
-    VQ = MultiMeshFunctionSpace(multimesh, TH)
     us,ps = [],[]
     for i in range(multimesh.num_parts()):
         us.append(XDMFFile("output/"+out_name+"u%d.xdmf" %i))
         ps.append(XDMFFile("output/"+out_name+"p%d.xdmf" %i))
-    out = {"VQ": VQ,"w":MultiMeshFunction(VQ)}
+    # The iterate and the line-search trial steps, with their solvers
+    state = MultiMeshState(multimesh)
+    trial = MultiMeshState.copy(state)
+    # Masks of the inactive dofs, recomputed only when the multimesh moves
+    u_mask = ActiveDofMask(state.splitter.V)
+    p_mask = ActiveDofMask(state.splitter.Q)
 
     # Compute original volume and baricenter of obstacle
-    Vol0, bx0, by0 = geometric_quantities(multimesh)
+    Vol0, bx0, by0 = geometric_quantities(state)
 
     it, max_it, mq_tol, mq, func_old = 0, 100, 0.05, 0.5, 1e2
     v_o = Constant(0)
@@ -390,6 +420,28 @@ if __name__ == "__main__":
     stp_min,stp_max = 1e-16,1e-1#5e-9, 1e-1
 
     sub_problem_it, Js, dJs, Vol_off, Bx_off, By_off, MQ = ([] for _ in range(7))
+    history_keys = ["sub_problem_it", "Js", "dJs", "Vol_off", "Bx_off",
+                    "By_off", "MQ"]
+    restart_file = "output/"+out_name+"restart.npz"
+    if "--restart" in sys.argv:
+        # Continue from last checkpoint, with the stored state as initial
+        # guess for the first solve
+        from restart import load_restart
+        state = load_restart(restart_file, [multimesh.part(i) for i in
+                                            range(multimesh.num_parts())],
+                             state.w)
+        multimesh.build()
+        it, func_old = int(state["it"]), float(state["func_old"])
+        vfac, bfac = Constant(float(state["vfac"])), Constant(float(state["bfac"]))
+        start_stp = float(state["start_stp"])
+        stp_min, stp_max = float(state["stp_min"]), float(state["stp_max"])
+        (sub_problem_it, Js, dJs, Vol_off, Bx_off, By_off,
+         MQ) = (list(state[key]) for key in history_keys)
+        search = moola.linesearch.ArmijoLineSearch(start_stp=start_stp,
+                                                   stpmax=stp_max,
+                                                   stpmin=stp_min)
+        v_o = vfac
+        print("Restarting from iteration %d" % it)
     meshfile = File("output/"+out_name+"mesh.pvd")
     while (it<max_it):
         time_it = time.time()
@@ -405,30 +457,30 @@ if __name__ == "__main__":
                                                        stpmax=stp_max,
                                                        stpmin=stp_min)
             v_o = vfac
-        u, p = StokesSolve(multimesh, out=out)
-        for dof in u.function_space().dofmap().inactive_dofs(multimesh,0):
-            u.vector()[dof]=np.nan
-        for dof in p.function_space().dofmap().inactive_dofs(multimesh,0):
-            p.vector()[dof]=np.nan
-        for i in range(multimesh.num_parts()):
-            us[i].write(u.part(i, deepcopy=True), float(it))
-            ps[i].write(p.part(i, deepcopy=True), float(it))
-        J = functional(u, multimesh, Vol0, bx0, by0, vfac=vfac, bfac=bfac)
-        gradient = functional_gradient(u, multimesh, Vol0, bx0, by0,
+        u, p = StokesSolve(state)
+        # Hide inactive dofs in output
+        u_mask.set_nan(u)
+        p_mask.set_nan(p)
+        with profiler.phase(IO):
+            for i in range(multimesh.num_parts()):
+                us[i].write(u.part(i, deepcopy=True), float(it))
+                ps[i].write(p.part(i, deepcopy=True), float(it))
+        J = functional(u, state, Vol0, bx0, by0, vfac=vfac, bfac=bfac)
+        gradient = functional_gradient(u, state, Vol0, bx0, by0,
                                        vfac=vfac, bfac=bfac)
         Js.append(float(J))
         
         def phi(step):
             step = Constant(step)
             print("Armijo-functional step %.3e" % step)
-            multimesh_s, w1_s = deform_mesh(multimesh, step, forget=True,
-                                            vfac=vfac, bfac=bfac)
-            u_s, p_s = StokesSolve(multimesh_s)
-            J = functional(u_s, multimesh_s, Vol0, bx0, by0, vfac=vfac,
+            state_s, w1_s = deform_mesh(state, step, trial=trial,
+                                        vfac=vfac, bfac=bfac)
+            u_s, p_s = StokesSolve(state_s)
+            J = functional(u_s, state_s, Vol0, bx0, by0, vfac=vfac,
                            bfac=bfac)
             return float(J)
         def phi_dphi0():
-            [mf_0, mf_1] = load_facet_function(multimesh)
+            [mf_0, mf_1] = state.mfs
             ds1 = ds(domain=multimesh.part(1), subdomain_data=mf_1)
             from femorph import VolumeNormal
             normal = VolumeNormal(multimesh.part(1), [0], mf_1)
@@ -459,7 +511,7 @@ if __name__ == "__main__":
         #     continue
         tmp_diff = func_old-J
         func_old = J
-        Vol, bx,by = geometric_quantities(multimesh)
+        Vol, bx,by = geometric_quantities(state)
         vol_off, bx_off, by_off = Vol-Vol0, bx-bx0, by-by0
         tmp_grad_norm = phi_dphi0()[1]
         dJs.append(np.sqrt(np.abs(tmp_grad_norm)))
@@ -473,28 +525,27 @@ if __name__ == "__main__":
         if cvt:
             from femorph.Legacy import DiscreteMeshRepair
             from femorph import VolumeNormal
-            mf_0,mf_1 = load_facet_function(multimesh)
-            cvt_time = -time.time()
-            n_ = VolumeNormal(multimesh.part(1),[0], mf_1)
-            (L1B, L2B,fix_deform) = DiscreteMeshRepair(multimesh.part(1), mf_1,
-                                                       SmoothVolume=False,
-                                                       SmoothBoundary=True,
-                                                       Tangential=True,
-                                                       VertexNormal=n_,
-                                                       MaxIter = 10, Step = 1.0,
-                                                       Stop = 1e-6,
-                                                       FixPlanes = [[1,0.5,1e-3]],Vis=False)
-            cvt_time += time.time()
-            print("CVT-time: %.2e" % cvt_time) 
+            mf_0,mf_1 = state.mfs
+            with profiler.phase(CVT):
+                n_ = VolumeNormal(multimesh.part(1),[0], mf_1)
+                (L1B, L2B,fix_deform) = DiscreteMeshRepair(multimesh.part(1), mf_1,
+                                                           SmoothVolume=False,
+                                                           SmoothBoundary=True,
+                                                           Tangential=True,
+                                                           VertexNormal=n_,
+                                                           MaxIter = 10, Step = 1.0,
+                                                           Stop = 1e-6,
+                                                           FixPlanes = [[1,0.5,1e-3]],Vis=False)
             print("Updating domain")
         
         
         print("Updating domain")
         if cvt:
-            multimesh, w1 = deform_mesh(multimesh, step, vfac=vfac, bfac=bfac,
-                                        cvt=fix_deform)
+            state, w1 = deform_mesh(state, step, vfac=vfac, bfac=bfac,
+                                    cvt=fix_deform)
         else:
-            multimesh, w1 = deform_mesh(multimesh, step, vfac=vfac, bfac=bfac)
+            state, w1 = deform_mesh(state, step, vfac=vfac, bfac=bfac)
+        multimesh = state.multimesh
         mq = min(MeshQuality.radius_ratio_min_max(multimesh.part(0))[0],
                  MeshQuality.radius_ratio_min_max(multimesh.part(1))[0])
         MQ.append(mq)
@@ -516,6 +567,18 @@ if __name__ == "__main__":
                 print("Reached max penalty parameter, Volume offset: %.2e%%" %(float((vol_off)/(Vol0)*100)))
                 break
         it += 1
+        from restart import save_restart
+        with profiler.phase(IO):
+            save_restart(restart_file, [multimesh.part(i) for i in
+                                        range(multimesh.num_parts())],
+                         state.w, it=it, func_old=float(func_old),
+                         vfac=float(vfac), bfac=float(bfac),
+                         start_stp=search.start_stp, stp_min=stp_min,
+                         stp_max=stp_max,
+                         **dict(zip(history_keys, [sub_problem_it, Js, dJs,
+                                                   Vol_off, Bx_off, By_off,
+                                                   MQ])))
+        profiler.next_iteration()
         print("Iteration-time: %d" %(time.time()-time_it)) 
         if mq < 0.05:
             plot(multimesh.part(1))
@@ -524,3 +587,6 @@ if __name__ == "__main__":
 
     np.savez("output/"+out_name+"Optimization_results.npz", J=Js,dJ=dJs, Vol=Vol_off, Bx=Bx_off, By=By_off, MQ=MQ, subproblem=sub_problem_it)
     print("Endtime %3d" %(time.time()-start))
+    profiler.report()
+    profiler.write_json("output/"+out_name+"timings.json")
+    profiler.write_csv("output/"+out_name+"timings.csv")
@@ -0,0 +1 @@
+../common/active_dofs.py
\ No newline at end of file
@@ -0,0 +1 @@
+../common/facet_markers.py
\ No newline at end of file
@@ -0,0 +1,104 @@
+"""
+Volume and barycenter of the obstacle in a channel discretized by a
+multimesh, used in the volume and barycenter penalties of the Stokes
+shape optimization.
+The quantities are either integrated over the fluid multimesh, or
+computed exactly from the polygonal boundary of the obstacle.
+"""
+import numpy
+from dolfin import (MultiMeshFunctionSpace, TestFunction, dX, Cell, Facet,
+                    assemble_multimesh, vertex_to_dof_map)
+from polygon import orient_edges, polygon_quantities
+
+class ObstacleGeometry():
+    def __init__(self, multimesh, length_width, cover_points=None,
+                 obstacle=None):
+        """
+        Arguments:
+            multimesh    - Multimesh of the fluid domain
+            length_width - Length and width of the channel
+            cover_points - Dictionary of auto_cover points. If given, the
+                           multimesh is rebuilt and covered before the
+                           quantities of a new mesh state are computed
+            obstacle     - Tuple (part, facet function, marker) of the
+                           obstacle boundary. If given, the quantities are
+                           computed from the boundary polygon, without
+                           building or assembling over the multimesh
+        """
+        self.multimesh = multimesh
+        self.length_width = length_width
+        self.cover_points = cover_points
+        self.key = None
+        self.values = None
+        self.edges = None
+        if obstacle is not None:
+            self.__init_polygon(*obstacle)
+            return
+        V = MultiMeshFunctionSpace(multimesh, "CG", 1)
+        # The integral of each CG1 basis function over the fluid domain,
+        # gives the volume as the sum, and the first moments as the sums
+        # weighted with the dof coordinates, as x and y are exactly CG1
+        self.L = TestFunction(V)*dX
+        # Vertex of each dof in the multimesh function vector
+        self.vertices = []
+        for i in range(multimesh.num_parts()):
+            v2d = vertex_to_dof_map(V.part(i))
+            d2v = numpy.empty(len(v2d), dtype=int)
+            d2v[v2d] = numpy.arange(len(v2d))
+            self.vertices.append(d2v)
+
+    def __init_polygon(self, part, facet_function, marker):
+        """
+        Find the boundary edges of the obstacle, oriented counter clockwise
+        around it. The orientation is fixed by the fluid cell of each edge,
+        and kept as long as the deformations do not invert the cells.
+        """
+        self.part = part
+        mesh = self.multimesh.part(part)
+        mesh.init(1, 2)
+        edges, opposite = [], []
+        for f in numpy.flatnonzero(facet_function.array() == marker):
+            facet = Facet(mesh, int(f))
+            edge = facet.entities(0)
+            cell = Cell(mesh, int(facet.entities(2)[0]))
+            edges.append(edge)
+            opposite.append(set(cell.entities(0)).difference(edge).pop())
+        self.edges = orient_edges(mesh.coordinates(), edges, opposite)
+
+    def __coordinates_key(self):
+        return tuple(hash(self.multimesh.part(i).coordinates().tobytes())
+                     for i in range(self.multimesh.num_parts()))
+
+    def dof_coordinates(self):
+        """ Coordinates of each dof of the CG1 multimesh function space """
+        return numpy.vstack([self.multimesh.part(i).coordinates()[d2v]
+                             for i, d2v in enumerate(self.vertices)])
+
+    def quantities(self):
+        """
+        Volume and barycenter (Vol, bx, by) of the obstacle. The values are
+        reused as long as no part of the multimesh has moved.
+        """
+        key = self.__coordinates_key()
+        if key == self.key:
+            return self.values
+        if self.edges is not None:
+            self.key = key
+            self.values = polygon_quantities(
+                self.multimesh.part(self.part).coordinates(), self.edges)
+            return self.values
+        if self.cover_points is not None:
+            self.multimesh.build()
+            for part, point in self.cover_points.items():
+                self.multimesh.auto_cover(part, point)
+        weights = assemble_multimesh(self.L).get_local()
+        fluid_vol = numpy.sum(weights)
+        fluid_x, fluid_y = weights.dot(self.dof_coordinates())
+        L, W = self.length_width
+        Vol = L*W - fluid_vol
+        bx = (0.5*L*L*W - fluid_x)/Vol
+        by = (0.5*W*W*L - fluid_y)/Vol
+        self.key = key
+        self.values = (Vol, bx, by)
+        return self.values
+
@@ -0,0 +1 @@
+../common/hdf5_writer.py
\ No newline at end of file
@@ -0,0 +1,38 @@
+"""
+Area and centroid of a polygonal obstacle, computed with the shoelace
+formula.
+The polygon is given as a set of oriented edges between the vertices of
+a mesh, such that only the boundary of the obstacle has to be known, and
+the edges do not have to be ordered along the boundary.
+"""
+import numpy
+
+def orient_edges(coordinates, edges, opposite):
+    """
+    Orient each edge such that the obstacle is on its left side, which
+    gives a counter clockwise traversal of the obstacle boundary.
+    Arguments:
+        coordinates - Vertex coordinates, shape (num_vertices, 2)
+        edges       - Vertex indices of each boundary edge, shape (n, 2)
+        opposite    - Vertex of the cell adjacent to each edge, opposite
+                      to the edge. The cells are outside the obstacle.
+    """
+    edges = numpy.array(edges, dtype=int)
+    a, b = coordinates[edges[:, 0]], coordinates[edges[:, 1]]
+    c = coordinates[opposite]
+    ab, ac = b - a, c - a
+    cell_left = (ab[:, 0]*ac[:, 1] - ab[:, 1]*ac[:, 0] > 0)
+    edges[cell_left] = edges[cell_left][:, ::-1]
+    return edges
+
+def polygon_quantities(coordinates, edges):
+    """
+    Area and centroid (area, cx, cy) of the polygon bounded by the
+    counter clockwise oriented edges
+    """
+    a, b = coordinates[edges[:, 0]], coordinates[edges[:, 1]]
+    cross = a[:, 0]*b[:, 1] - b[:, 0]*a[:, 1]
+    area = 0.5*numpy.sum(cross)
+    cx = numpy.sum((a[:, 0] + b[:, 0])*cross)/(6*area)
+    cy = numpy.sum((a[:, 1] + b[:, 1])*cross)/(6*area)
+    return area, cx, cy
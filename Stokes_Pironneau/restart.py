@@ -0,0 +1,36 @@
+"""
+Binary checkpoints of the steepest descent drivers, such that a long
+optimization can be resumed after a crash. A checkpoint holds the
+coordinates of each mesh, the state vector of the last solve and any
+scalar or array valued driver state (penalty factors, line-search
+step, iteration counters, functional history).
+"""
+import os
+import numpy
+
+def save_restart(filename, meshes, w, **state):
+    """
+    Save the mesh coordinates, state vector and driver state.
+    The file is written to a temporary file first, so that a crash while
+    writing never destroys the previous checkpoint.
+    """
+    data = {"coordinates_%d" % i: mesh.coordinates()
+            for i, mesh in enumerate(meshes)}
+    tmp = filename + ".tmp"
+    with open(tmp, "wb") as outfile:
+        numpy.savez(outfile, w=w.vector().get_local(), **data, **state)
+    os.replace(tmp, filename)
+
+def load_restart(filename, meshes, w):
+    """
+    Move the meshes to the saved coordinates and set the state vector.
+    The caller has to rebuild the multimesh before the next solve.
+    Returns the driver state as a dictionary.
+    """
+    data = numpy.load(filename)
+    for i, mesh in enumerate(meshes):
+        mesh.coordinates()[:] = data["coordinates_%d" % i]
+    w.vector().set_local(data["w"])
+    w.vector().apply("insert")
+    return {key: data[key] for key in data.files
+            if key != "w" and not key.startswith("coordinates_")}
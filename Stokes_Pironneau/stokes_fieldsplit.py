@@ -0,0 +1 @@
+../common/stokes_fieldsplit.py
\ No newline at end of file
@@ -1,12 +1,18 @@
 from dolfin import *
 from IPython import embed
 from pdb import set_trace
+from collections import OrderedDict
 import numpy as np
 import matplotlib.pyplot as plt
+from mixed_split import MixedSplitter
+from mesh_templates import templates
+from profiler import profiler, BUILD, AUTO_COVER, FORMS, ASSEMBLE, BCS, LOCK,\
+    FACTORIZE, SOLVE, GRADIENT, IO
 
 class StokesSolver():
     set_log_level(LogLevel.ERROR)
-    def __init__(self, points, thetas, mesh_names, facet_func_names, inlets):
+    def __init__(self, points, thetas, mesh_names, facet_func_names, inlets,
+                 linear_solver="mumps", krylov_rtol=1e-10, krylov_max_it=1000):
         """
         Initialize Stokes solver for objects located at "points"
         with orientation "thetas" with meshes from "mesh_names"
@@ -18,6 +24,13 @@ class StokesSolver():
             facet_func_names list(str)- The facet_func filnames
             inlets dict               - Dictonary containing positions of inlets
                                         as well as amplitude
+            linear_solver str         - "mumps" for a direct solve, or
+                                        "gmres" preconditioned with an
+                                        additive fieldsplit, with AMG on
+                                        the velocity operator and Jacobi
+                                        on the pressure mass matrix
+            krylov_rtol float         - Relative tolerance of GMRES
+            krylov_max_it int         - Maximal number of GMRES iterations
         """
         self.J = 0
         self.dJ = 0
@@ -27,8 +40,8 @@ class StokesSolver():
         self.obstacle_marker = 4
         self.wall_marker = 5
         self.N = len(points)
-        self.outu = [File("output/u_%d.pvd" %i) for i in range(self.N+1)]
-        self.outp = [File("output/p_%d.pvd" %i) for i in range(self.N+1)]
+        self.writer = None # Created at first save_state
+        self.output_stride = 1 # Write every output_stride-th state
         self.points = points
         self.s = [Expression(("-x[1]+%s" % points[i][1],
                               "x[0]-%s" % points[i][0]), degree=3)
@@ -44,28 +57,32 @@ class StokesSolver():
         self.w = MultiMeshFunction(self.VQ, name="State")
         self.u = MultiMeshFunction(V, name="u")
         self.p = MultiMeshFunction(Q, name="p")
+        self.splitter = MixedSplitter(self.VQ, V, Q)
+        self.init_forms()
+        self.init_linear_solver(linear_solver, krylov_rtol, krylov_max_it)
+        self.cache_size = 8 # Number of evaluations kept in memory
+        self.cache = OrderedDict()
+        self.state_key = None # Angles of the current state
 
     def init_multimesh(self, meshes_n, facet_funcs,theta,p): 
         multimesh = MultiMesh()
         mfs = []
         meshes = []
         for i in range(self.N+1):
-            mesh_i = Mesh()
-            with XDMFFile(meshes_n[i]) as infile:
-                infile.read(mesh_i)
-            mvc = MeshValueCollection("size_t", mesh_i, 1)
-            with XDMFFile(facet_funcs[i]) as infile:
-                infile.read(mvc, "name_to_read")
-            mfs.append(cpp.mesh.MeshFunctionSizet(mesh_i, mvc))
+            # Obstacles sharing a mesh file are copies of one template
+            mesh_i, mf_i = templates.instance(meshes_n[i], facet_funcs[i])
+            mfs.append(mf_i)
             if i>0:
                 mesh_i.translate(Point(p[i-1][0]-0.5, p[i-1][1]-0.5))
                 mesh_i.rotate(theta[i-1], 2, p[i-1])
             meshes.append(mesh_i)
             multimesh.add(mesh_i)
-        multimesh.build()
+        with profiler.phase(BUILD):
+            multimesh.build()
         self.mfs = mfs
         self.meshes = meshes
         self.multimesh = multimesh
+        self.covered = False # auto_cover not yet called after build
 
     """
     Several helper functions for the linear and bilinear weak formulation
@@ -106,45 +123,76 @@ class StokesSolver():
         """
         Split a mixed multimeshfunction into separate multimeshfunctions
         """
-        for i in range(self.multimesh.num_parts()):
-            Vi = FunctionSpace(self.multimesh.part(i), self.V2)
-            Pi = FunctionSpace(self.multimesh.part(i), self.S1)
-            ui, pi = self.w.part(i, deepcopy=True).split()
-
-            self.u.assign_part(i, interpolate(ui,Vi))
-            self.p.assign_part(i, interpolate(pi,Pi))
+        self.splitter.split(self.w, self.u, self.p)
 
     def save_state(self):
         """
-        Save current velocity and pressure to file
+        Append current velocity, pressure and rotated obstacle meshes to
+        output/state.h5
         """
         # for dof in self.u.function_space().dofmap().inactive_dofs(self.multimesh,0):
         #     self.u.vector()[dof]=np.nan
         # for dof in self.p.function_space().dofmap().inactive_dofs(self.multimesh,0):
         #     self.p.vector()[dof]=np.nan
 
-        for i in range(self.multimesh.num_parts()):
-            self.outu[i] << self.u.part(i)
-            self.outp[i] << self.p.part(i)
+        if self.writer is None:
+            from hdf5_writer import TimeSeriesWriter
+            self.writer = TimeSeriesWriter("output/state.h5",
+                                           moving_parts=range(1, self.N+1),
+                                           stride=self.output_stride)
+        parts = range(self.multimesh.num_parts())
+        with profiler.phase(IO):
+            self.writer.write([self.multimesh.part(i) for i in parts],
+                              {"u": [self.u.part(i) for i in parts],
+                               "p": [self.p.part(i) for i in parts]},
+                              t=self.opt_it)
     
     def update_mesh(self, angles):
         """
-        Rotate obstacles to angle specified in arrayx
+        Rotate obstacles to angle specified in arrayx, and rebuild the
+        multimesh if any obstacle moved
         """
+        moved = set()
         for i in range(1,self.N+1):
-            self.meshes[i].rotate(angles[i-1]-self.thetas[i-1],
-                                  2, self.points[i-1])
-            self.thetas[i-1] = angles[i-1]
-        self.multimesh.build()
+            if angles[i-1] != self.thetas[i-1]:
+                self.meshes[i].rotate(angles[i-1]-self.thetas[i-1],
+                                      2, self.points[i-1])
+                self.thetas[i-1] = angles[i-1]
+                moved.add(i)
+        self.rebuild_multimesh(moved)
+
+    def rebuild_multimesh(self, moved_parts):
+        """
+        Rebuild the multimesh and cover the obstacles after the given parts
+        have been rotated. The multimesh is built and covered once per
+        evaluation, instead of building it both before and after the
+        rotation. This is not a partial rebuild: MultiMesh.build always
+        recomputes the collisions and quadrature rules of all parts, and
+        the check on moved_parts only guards against rebuilding an
+        unchanged multimesh.
+        """
+        if len(moved_parts) == 0 and self.covered:
+            return
+        with profiler.phase(BUILD):
+            self.multimesh.build()
+        # Set inactive dofs
+        with profiler.phase(AUTO_COVER):
+            for i in range(self.N):
+                self.multimesh.auto_cover(0, self.points[i])
+        self.covered = True
 
     def ufl_J(self, u):
         return inner(grad(u),grad(u))*dX
-    
-    def eval_J(self, angles, printing=False):
-        if printing:
-            print(", ".join(['{:2.8f}'.format(i).rjust(5) for i in angles]))
-        self.multimesh.build()
-        self.update_mesh(angles)
+
+    @profiler.timed(FORMS)
+    def init_forms(self):
+        """
+        Create the Stokes forms, boundary conditions and functional once.
+        The forms only depends on the multimesh through the facet normal
+        and circumradius, which are evaluated at assembly, and the
+        boundary conditions follows the facet functions of the rotated
+        meshes, so all of them are reused for every evaluation.
+        """
         mf_0 = self.mfs[0]
         mfs = self.mfs[1:]
         (u, p) = TrialFunctions(self.VQ)
@@ -155,55 +203,141 @@ class StokesSolver():
         h = 2.0*Circumradius(self.multimesh)
         
         # Define bilinear and linear form
-        a = self.a_h(u, v, n, h) + self.b_h(v, p, n) + self.b_h(u, q, n)\
+        self.a = self.a_h(u, v, n, h) + self.b_h(v, p, n) + self.b_h(u, q, n)\
             + self.s_O(u, v) + self.s_C(u, p, v, q, h)
-        L  = self.l_h(v, q, f) + self.l_C(v, q, f, h)
-        
-        # Set inactive dofs
-        for i in range(self.N):
-            self.multimesh.auto_cover(0, self.points[i])
+        self.L  = self.l_h(v, q, f) + self.l_C(v, q, f, h)
+        # Block diagonal preconditioner matrix, velocity block and pressure
+        # mass matrix as approximation of the Schur complement, split into
+        # the two fields by the Krylov solver
+        self.a_P = self.a_h(u, v, n, h) + self.s_O(u, v) + p*q*dX
 
         # Create boundary conditions
-        inflow_value = Expression(("1.0", "0.0"),degree=1)
-        outflow_value = Constant(0)
         noslip_value =  Expression(("0.0", "0.0"), degree=2)
         obstacle_value = Expression(("0.0", "0.0"), degree=2)
         V = MultiMeshSubSpace(self.VQ, 0)
-        Q = MultiMeshSubSpace(self.VQ, 1)
-        bcs = []
+        self.bcs = []
         for inlet in self.inlets:
-            bcs.append(MultiMeshDirichletBC(V, inlet[0],  mf_0, inlet[1], 0))
-        bcs.append(MultiMeshDirichletBC(V, noslip_value,  mf_0,
-                                        self.wall_marker, 0))
-
+            self.bcs.append(MultiMeshDirichletBC(V, inlet[0],  mf_0,
+                                                 inlet[1], 0))
+        self.bcs.append(MultiMeshDirichletBC(V, noslip_value,  mf_0,
+                                             self.wall_marker, 0))
         for i in range(1,self.N+1):
-            bcs.append(MultiMeshDirichletBC(V, obstacle_value,
-                                            mfs[i-1], self.obstacle_marker ,i))
+            self.bcs.append(MultiMeshDirichletBC(V, obstacle_value,
+                                                 mfs[i-1],
+                                                 self.obstacle_marker ,i))
+        self.J_form = self.ufl_J(self.u)
+    
+    def init_linear_solver(self, linear_solver, rtol=1e-10, max_it=1000):
+        """
+        Create the Krylov solver used if the direct solver is not chosen.
+        The solver starts from the current state, which is the solution
+        at the previously evaluated angles.
+        """
+        self.linear_solver = linear_solver
+        if linear_solver == "mumps":
+            self.krylov = None
+            return
+        # The stabilization s_C makes the system non-symmetric, so MINRES
+        # and CG are not applicable
+        if linear_solver != "gmres":
+            raise ValueError("Unsupported linear solver %s, use \"mumps\" "
+                             "or \"gmres\"" % linear_solver)
+        from stokes_fieldsplit import StokesFieldSplit
+        self.krylov = StokesFieldSplit(self.VQ, self.splitter, self.a_P,
+                                       self.bcs, rtol, max_it)
+
+    def solve_system(self, A, b):
+        """
+        Solve the locked Stokes system, with MUMPS or the preconditioned
+        Krylov solver
+        """
+        if self.krylov is None:
+            # Each system is solved once, and MUMPS factorizes and solves
+            # in the same call, dominated by the factorization
+            with profiler.phase(FACTORIZE):
+                solve(A, self.w.vector(), b, "mumps")
+            return
+        # The preconditioner is assembled once per geometry, while the AMG
+        # hierarchy of the velocity split is built by PETSc inside the
+        # Krylov solve
+        with profiler.phase(FACTORIZE):
+            self.krylov.set_operator(A, b)
+        with profiler.phase(SOLVE):
+            self.krylov.solve(self.w.vector(), b)
+
+    def cache_key(self, angles):
+        return np.asarray(angles, dtype=float).tobytes()
+
+    def cache_lookup(self, angles):
+        """
+        Return the stored evaluation at the given angles, or None.
+        If the current state was computed at other angles, the obstacles
+        and state are moved back to the stored point.
+        """
+        key = self.cache_key(angles)
+        if key not in self.cache:
+            return None
+        self.cache.move_to_end(key)
+        entry = self.cache[key]
+        if key != self.state_key:
+            self.update_mesh(angles)
+            self.w.vector()[:] = entry["w"]
+            self.splitMMF()
+            self.state_key = key
+        self.J = entry["J"]
+        return entry
+
+    def cache_store(self, **values):
+        """ Store values for the current state, evicting the oldest entry """
+        self.cache.setdefault(self.state_key, {}).update(values)
+        self.cache.move_to_end(self.state_key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def eval_J(self, angles, printing=False):
+        if printing:
+            print(", ".join(['{:2.8f}'.format(i).rjust(5) for i in angles]))
+        if self.cache_lookup(angles) is not None:
+            return self.J
+        self.update_mesh(angles)
+
         # Assemble linear system, apply boundary conditions and solve
-        A = assemble_multimesh(a)
-        b = assemble_multimesh(L)
-        [bc.apply(A, b) for bc in bcs]
-        self.VQ.lock_inactive_dofs(A, b)
-        solve(A, self.w.vector(), b, "mumps")
+        with profiler.phase(ASSEMBLE):
+            A = assemble_multimesh(self.a)
+            b = assemble_multimesh(self.L)
+        with profiler.phase(BCS):
+            [bc.apply(A, b) for bc in self.bcs]
+        with profiler.phase(LOCK):
+            self.VQ.lock_inactive_dofs(A, b)
+        self.solve_system(A, b)
         self.splitMMF()
-        self.J = assemble_multimesh(self.ufl_J(self.u)) 
+        with profiler.phase(ASSEMBLE):
+            self.J = assemble_multimesh(self.J_form)
+        self.state_key = self.cache_key(angles)
+        self.cache_store(J=self.J, w=self.w.vector().get_local())
         return self.J
 
     def eval_dJ(self,angles):
+        entry = self.cache_lookup(angles)
+        if entry is not None and "dJ" in entry:
+            self.dJ = entry["dJ"].copy()
+            return self.dJ
 
         self.J = self.eval_J(angles, printing=False)
         
         dJ = np.zeros(self.N)
-        for i in range(1,self.N+1):
-            u_i = self.u.part(i, deepcopy=True)
-            stokes_i = inner(grad(u_i), grad(u_i))
-            mf_i = self.mfs[i]
-            normal_i = FacetNormal(self.multimesh.part(i))
-            dS_i = Measure("ds", domain=self.multimesh.part(i),
-                           subdomain_data=mf_i)
-            dJ[i-1] = -assemble(stokes_i*inner(normal_i, self.s[i-1])
-                               *dS_i(self.obstacle_marker))
+        with profiler.phase(GRADIENT):
+            for i in range(1,self.N+1):
+                u_i = self.u.part(i, deepcopy=True)
+                stokes_i = inner(grad(u_i), grad(u_i))
+                mf_i = self.mfs[i]
+                normal_i = FacetNormal(self.multimesh.part(i))
+                dS_i = Measure("ds", domain=self.multimesh.part(i),
+                               subdomain_data=mf_i)
+                dJ[i-1] = -assemble(stokes_i*inner(normal_i, self.s[i-1])
+                                    *dS_i(self.obstacle_marker))
         self.dJ = 180./pi*dJ
+        self.cache_store(dJ=self.dJ.copy())
         return self.dJ
 
     def callback(self,angles):
@@ -211,18 +345,17 @@ class StokesSolver():
         self.save_state()
         print("Iteration: %d" % self.opt_it)
         self.opt_it += 1
+        profiler.next_iteration()
         print("J: %.5e" % self.J)
         print("Gradients")
         print(", ".join(['{:2.8f}'.format(i).rjust(5) for i in self.dJ]))
         print("Angles")
         print(", ".join(['{:2.8f}'.format(i).rjust(5) for i in angles]))
         
-def all_angles():
-    # solve single rotation problem for all angles and compute gradient
-    import numpy as np
-    import os
-    os.system("mkdir -p figures")
-    angles = np.linspace(0,180,25)
+def sweep_solver():
+    """
+    Create the single obstacle solver used in the global sweep
+    """
     points = [Point(0.5,0.5)]
     thetas = [0]
     inlet_str= "-A*(x[1]-x_l)*(x[1]-x_u)"
@@ -233,28 +366,30 @@ def all_angles():
     pre = "meshes/"
     meshes = [pre+"multimesh_0.xdmf"] +  [pre+"multimesh_1.xdmf"]*len(points)
     mfs = [pre+"mf_0.xdmf"] + [pre+"mf_1.xdmf"]*len(points)
-    solver = StokesSolver(points, thetas, meshes, mfs, inlet_data)
+    return StokesSolver(points, thetas, meshes, mfs, inlet_data)
+
+def all_angles():
+    # solve single rotation problem for all angles and compute gradient
+    import numpy as np
+    import os
+    from angle_sweep import sweep
+    os.system("mkdir -p figures")
+    os.system("mkdir -p results")
+    angles = np.linspace(0,180,25)
+    records = sweep(sweep_solver, angles, "results/StokesAllAngles.npz")
+    Js = records["J"]
+    dJds = records["dJ"][:,0]
 
-    Js = []
-    dJds = []
-    out0 = File("output/Stokes0_new.pvd")
-    out = File("output/Stokes_new.pvd")
     minmax_theta = []
     minmax_grad = []
-    i = 0
-    for theta in angles:
-        Js.append(solver.eval_J([theta]))
-        dJds.append(solver.eval_dJ([theta]))
-        if i >0 and dJds[-1]/dJds[-2] < 0:
+    for i in range(1, len(angles)):
+        if dJds[i]/dJds[i-1] < 0:
             print("Minmax found")
             minmax_theta.append(angles[i-1])
-            minmax_theta.append(theta)
-            minmax_grad.append(dJds[-2])
-            minmax_grad.append(dJds[-1])
-            print(theta, Js[-1], dJds[-1],dJds[-2])
-        out0 << solver.u.part(0)
-        out << solver.u.part(1)
-        i+=1
+            minmax_theta.append(angles[i])
+            minmax_grad.append(dJds[i-1])
+            minmax_grad.append(dJds[i])
+            print(angles[i], Js[i], dJds[i],dJds[i-1])
     print(angles[np.argmin(Js)], Js[np.argmin(Js)])
     print(angles[np.argmin(np.abs(dJds))], dJds[np.argmin(np.abs(dJds))])
 
@@ -121,12 +121,24 @@ def front_mesh(res=0.025):
         cell_data={"line": {"name_to_read":
                             cell_data["line"]["gmsh:physical"]}}))
 
+def mesh_files(i):
+    """ Files written for the i-th mesh of the multimesh """
+    return ["meshes/%s_%d.%s" % (name, i, ext)
+            for name in ["multimesh", "mf"] for ext in ["xdmf", "h5"]]
+
         
 if __name__=="__main__":
     import sys
+    from mesh_cache import cached_mesh
     try:
         res = float(sys.argv[1])
     except IndexError:
         res = 0.01
-    background_mesh(res)
-    front_mesh(res)
+    params = {"inlet0_marker": inlet0_marker, "inlet1_marker": inlet1_marker,
+              "outlet_marker": outlet_marker,
+              "obstacle_marker": obstacle_marker, "wall_marker": wall_marker,
+              "inlet0": inlet0, "inlet1": inlet1, "outlet": outlet,
+              "L": L, "H": H, "c_x": c_x, "c_y": c_y, "r_x": r_x, "r_y": r_y,
+              "width_scale": width_scale}
+    cached_mesh(background_mesh, res, mesh_files(0), params)
+    cached_mesh(front_mesh, res, mesh_files(1), params)
@@ -0,0 +1,47 @@
+"""
+Registry of template meshes read from file. Each distinct mesh and facet
+function file is parsed once, and every rigid obstacle instance gets an
+in-memory copy of the template, which can be moved independently.
+"""
+from dolfin import Mesh, MeshFunction, MeshValueCollection, XDMFFile, cpp
+
+class MeshTemplates():
+    def __init__(self):
+        self.meshes = {}
+        self.markers = {}
+
+    def mesh(self, mesh_file):
+        """ Template mesh of mesh_file, read at the first request """
+        if mesh_file not in self.meshes:
+            mesh = Mesh()
+            with XDMFFile(mesh_file) as infile:
+                infile.read(mesh)
+            self.meshes[mesh_file] = mesh
+        return self.meshes[mesh_file]
+
+    def facet_markers(self, mesh_file, facet_file):
+        """ Facet marker array of facet_file on the template of mesh_file """
+        key = (mesh_file, facet_file)
+        if key not in self.markers:
+            mesh = self.mesh(mesh_file)
+            mvc = MeshValueCollection("size_t", mesh, 1)
+            with XDMFFile(facet_file) as infile:
+                infile.read(mvc, "name_to_read")
+            # The array is a view into the temporary MeshFunction, so it
+            # is copied before the function is freed
+            self.markers[key] = cpp.mesh.MeshFunctionSizet(
+                mesh, mvc).array().copy()
+        return self.markers[key]
+
+    def instance(self, mesh_file, facet_file):
+        """
+        Copy of the template mesh and its facet function. The copies share
+        no data with the template, so they can be translated and rotated.
+        """
+        mesh = Mesh(self.mesh(mesh_file))
+        mf = MeshFunction("size_t", mesh, mesh.topology().dim()-1)
+        mf.set_values(self.facet_markers(mesh_file, facet_file))
+        return mesh, mf
+
+# Shared by all solvers, such that repeated setups do not read files again
+templates = MeshTemplates()
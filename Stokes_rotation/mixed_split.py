@@ -0,0 +1 @@
+../common/mixed_split.py
\ No newline at end of file
@@ -0,0 +1,205 @@
+"""
+Benchmark of the MultiMesh operations the solvers depend on, on synthetic
+multimeshes with a unit square background and N elliptic annulus parts:
+    build              - MultiMesh.build
+    auto_cover         - auto_cover from the center of each annulus
+    assemble_poisson   - Nitsche Poisson system, CG1
+    assemble_stokes    - Stokes system, Taylor-Hood P2-P1
+    lock_poisson       - lock_inactive_dofs of the Poisson system
+    lock_stokes        - lock_inactive_dofs of the Stokes system
+    solve_poisson      - Direct solve of the Poisson system
+    solve_stokes       - Direct solve of the Stokes system
+The part count and the resolution are swept, and the timings are saved as
+JSON, such that runs on different versions can be compared with --compare.
+
+Usage:
+    python3 multimesh_primitives.py --parts 1 4 9 --resolutions 16 32 64
+    python3 multimesh_primitives.py --compare old.json new.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+from multiprocessing import cpu_count
+from time import perf_counter
+import numpy
+from dolfin import (Circumradius, Constant, FacetNormal, FiniteElement,
+                    MultiMeshDirichletBC, MultiMeshFunction,
+                    MultiMeshFunctionSpace, MultiMeshSubSpace, Point,
+                    TestFunction, TestFunctions, TrialFunction,
+                    TrialFunctions, VectorElement, assemble_multimesh,
+                    avg, dC, dI, dO, dX, div, dot, grad, inner, jump, outer,
+                    solve, __version__)
+from synthetic_meshes import synthetic_multimesh, inflow, walls, outflow,\
+    obstacle
+
+def poisson_problem(multimesh, mfs, alpha=4.0, beta=4.0):
+    """
+    Nitsche Poisson problem, as in Poisson_rotation, with the temperature
+    0 on the channel boundary and 1 on the obstacles
+    """
+    V = MultiMeshFunctionSpace(multimesh, "CG", 1)
+    T, v = TrialFunction(V), TestFunction(V)
+    n = FacetNormal(multimesh)
+    h = 2.0*Circumradius(multimesh)
+    h = (h("+") + h("-"))/2
+    a = dot(grad(T), grad(v))*dX\
+        - (dot(avg(grad(T)), jump(v, n))*dI
+           + dot(avg(grad(v)), jump(T, n))*dI)\
+        + alpha/h*jump(T)*jump(v)*dI\
+        + beta*dot(jump(grad(T)), jump(grad(v)))*dO
+    L = Constant(1)*v*dX
+    bcs = [MultiMeshDirichletBC(V, Constant(0), mfs[0], marker, 0)
+           for marker in [inflow, walls, outflow]]
+    bcs += [MultiMeshDirichletBC(V, Constant(1), mfs[i], obstacle, i)
+            for i in range(1, multimesh.num_parts())]
+    return V, a, L, bcs
+
+def stokes_problem(multimesh, mfs, alpha=6.0):
+    """
+    Stokes flow past the obstacles, with the forms of
+    Stokes_Pironneau/StokesSolver.py
+    """
+    cell = multimesh.part(0).ufl_cell()
+    VQ = MultiMeshFunctionSpace(multimesh, VectorElement("CG", cell, 2)
+                                * FiniteElement("CG", cell, 1))
+    (u, p), (v, q) = TrialFunctions(VQ), TestFunctions(VQ)
+    n = FacetNormal(multimesh)
+    h = 2.0*Circumradius(multimesh)
+    f = Constant((0, 0))
+    tensor_jump = lambda u: outer(u("+"), n("+")) + outer(u("-"), n("-"))
+    a = inner(grad(u), grad(v))*dX\
+        - inner(avg(grad(u)), tensor_jump(v))*dI\
+        - inner(avg(grad(v)), tensor_jump(u))*dI\
+        + Constant(alpha)/avg(h)*inner(jump(u), jump(v))*dI\
+        + inner(jump(grad(u)), jump(grad(v)))*dO\
+        - div(u)*q*dX - div(v)*p*dX\
+        + jump(u, n)*avg(q)*dI + jump(v, n)*avg(p)*dI\
+        + h*h*inner(-div(grad(u)) + grad(p), -div(grad(v)) - grad(q))*dC\
+        + h("+")*h("+")*inner(-div(grad(u("+"))) + grad(p("+")),
+                              -div(grad(v("+"))) + grad(q("+")))*dO
+    L = inner(f, v)*dX\
+        + h*h*inner(f, -div(grad(v)) - grad(q))*dC\
+        + h("+")*h("+")*inner(f("+"), -div(grad(v("+"))) - grad(q("+")))*dO
+    V = MultiMeshSubSpace(VQ, 0)
+    bcs = [MultiMeshDirichletBC(V, Constant((1, 0)), mfs[0], marker, 0)
+           for marker in [inflow, walls]]
+    bcs += [MultiMeshDirichletBC(V, Constant((0, 0)), mfs[i], obstacle, i)
+            for i in range(1, multimesh.num_parts())]
+    return VQ, a, L, bcs
+
+def timeit(function, repeat):
+    """ Wall times of repeat calls to function """
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        times.append(perf_counter() - start)
+    return times
+
+def benchmark(num_parts, resolution, repeat=3, solver="mumps",
+              skip_solve=False):
+    """
+    Time each primitive on the multimesh with num_parts annuli at the
+    given resolution. Returns a list with one record per primitive.
+    """
+    multimesh, mfs, layout = synthetic_multimesh(num_parts, resolution)
+    cover_points = [Point(*part["center"]) for part in layout]
+    def cover():
+        for point in cover_points:
+            multimesh.auto_cover(0, point)
+
+    timings = {"build": timeit(multimesh.build, repeat)}
+    # auto_cover requires a newly built multimesh
+    times = []
+    for _ in range(repeat):
+        multimesh.build()
+        times += timeit(cover, 1)
+    timings["auto_cover"] = times
+
+    sizes = {"num_cells": sum(multimesh.part(i).num_cells()
+                              for i in range(multimesh.num_parts()))}
+    for name, problem in [("poisson", poisson_problem),
+                          ("stokes", stokes_problem)]:
+        V, a, L, bcs = problem(multimesh, mfs)
+        sizes["num_dofs_%s" % name] = V.dim()
+        timings["assemble_%s" % name] = timeit(
+            lambda: (assemble_multimesh(a), assemble_multimesh(L)), repeat)
+        A, b = assemble_multimesh(a), assemble_multimesh(L)
+        for bc in bcs:
+            bc.apply(A, b)
+        timings["lock_%s" % name] = timeit(
+            lambda: V.lock_inactive_dofs(A, b), repeat)
+        if skip_solve:
+            continue
+        x = MultiMeshFunction(V).vector()
+        timings["solve_%s" % name] = timeit(lambda: solve(A, x, b, solver),
+                                            repeat)
+
+    return [dict(parts=num_parts, resolution=resolution, primitive=name,
+                 times=times, min=min(times),
+                 median=float(numpy.median(times)), **sizes)
+            for name, times in timings.items()]
+
+def run(parts, resolutions, repeat=3, solver="mumps", skip_solve=False):
+    """ Benchmark all combinations of part counts and resolutions """
+    results = []
+    for resolution in resolutions:
+        for num_parts in parts:
+            records = benchmark(num_parts, resolution, repeat, solver,
+                                skip_solve)
+            for record in records:
+                print("parts=%3d res=%4d %-17s median %.3e s"
+                      % (num_parts, resolution, record["primitive"],
+                         record["median"]))
+            results += records
+    return {"meta": {"date": datetime.datetime.now().isoformat(),
+                     "dolfin": __version__, "python": platform.python_version(),
+                     "machine": platform.machine(), "node": platform.node(),
+                     "cores": cpu_count(), "repeat": repeat,
+                     "solver": solver},
+            "results": results}
+
+def compare(old_file, new_file):
+    """ Print the ratio of the median times in new_file and old_file """
+    def medians(filename):
+        with open(filename) as infile:
+            data = json.load(infile)
+        return {(r["parts"], r["resolution"], r["primitive"]): r["median"]
+                for r in data["results"]}
+    old, new = medians(old_file), medians(new_file)
+    print("%5s %5s %-17s %10s %10s %7s" % ("parts", "res", "primitive",
+                                            "old [s]", "new [s]", "new/old"))
+    for key in sorted(set(old.keys()) & set(new.keys())):
+        print("%5d %5d %-17s %10.3e %10.3e %7.2f"
+              % (key + (old[key], new[key], new[key]/old[key])))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--parts", type=int, nargs="+", default=[1, 4, 9])
+    parser.add_argument("--resolutions", type=int, nargs="+",
+                        default=[16, 32, 64])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--solver", default="mumps",
+                        help="Direct solver passed to dolfin.solve")
+    parser.add_argument("--skip-solve", action="store_true")
+    parser.add_argument("--output", default=None,
+                        help="JSON-file, defaults to results/<date>.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="Compare two result files instead of running")
+    args = parser.parse_args()
+    if args.compare is not None:
+        compare(*args.compare)
+    else:
+        data = run(args.parts, args.resolutions, args.repeat, args.solver,
+                   args.skip_solve)
+        output = args.output
+        if output is None:
+            output = "results/multimesh_%s.json" % datetime.datetime.now()\
+                .strftime("%Y%m%d_%H%M%S")
+        if os.path.dirname(output):
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+        with open(output, "w") as outfile:
+            json.dump(data, outfile, indent=1)
+        print("Results written to %s" % output)
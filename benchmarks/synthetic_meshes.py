@@ -0,0 +1,138 @@
+"""
+Synthetic multimeshes for the benchmarks: a unit square background mesh
+with N elliptic annulus parts, created in memory with MeshEditor.
+The hole of each annulus is an obstacle, which is removed from the
+background mesh by auto_cover, as in the Stokes and Poisson examples.
+"""
+import numpy
+from dolfin import (CompiledSubDomain, Mesh, MeshEditor, MeshFunction,
+                    MultiMesh, Point, UnitSquareMesh)
+
+# Facet markers
+inflow, outflow, walls = 1, 2, 3 # Background mesh
+obstacle, outer = 1, 2 # Annulus parts
+
+def annulus_points_cells(center, r_inner, r_outer, n_radial, n_angular,
+                         aspect=1.0, angle=0.0):
+    """
+    Vertices and triangles of a structured elliptic annulus.
+    The vertices are numbered ring by ring from the inside, such that the
+    vertices of the obstacle boundary are the first n_angular vertices.
+    Arguments:
+        center            - Center of the annulus
+        r_inner, r_outer  - Radii of the annulus along the major axis
+        n_radial          - Number of cell layers between the radii
+        n_angular         - Number of vertices along each ring
+        aspect            - Ratio of minor and major axis
+        angle             - Rotation of the major axis
+    """
+    radii = numpy.linspace(r_inner, r_outer, n_radial+1)
+    theta = numpy.linspace(0, 2*numpy.pi, n_angular, endpoint=False)
+    r, t = numpy.meshgrid(radii, theta, indexing="ij")
+    local = numpy.vstack((r.flatten()*numpy.cos(t.flatten()),
+                          aspect*r.flatten()*numpy.sin(t.flatten())))
+    rotation = numpy.array([[numpy.cos(angle), -numpy.sin(angle)],
+                            [numpy.sin(angle), numpy.cos(angle)]])
+    points = (rotation.dot(local)).T + numpy.asarray(center)
+
+    j, k = numpy.meshgrid(numpy.arange(n_radial), numpy.arange(n_angular),
+                          indexing="ij")
+    j, k = j.flatten(), k.flatten()
+    a = j*n_angular + k
+    b = j*n_angular + (k+1) % n_angular
+    c = a + n_angular
+    d = b + n_angular
+    # Counter clockwise triangles
+    cells = numpy.vstack((numpy.array([a, d, b]).T, numpy.array([a, c, d]).T))
+    return points, cells
+
+def mesh_from_arrays(points, cells):
+    """ Create a triangle mesh from vertex and cell arrays """
+    mesh = Mesh()
+    editor = MeshEditor()
+    editor.open(mesh, "triangle", 2, 2)
+    editor.init_vertices(len(points))
+    editor.init_cells(len(cells))
+    for i, point in enumerate(points):
+        editor.add_vertex(i, point)
+    for i, cell in enumerate(cells):
+        editor.add_cell(i, cell)
+    editor.close()
+    return mesh
+
+def annulus_mesh(center, r_inner, r_outer, h, aspect=1.0, angle=0.0):
+    """
+    Elliptic annulus with cell size about h, and its facet function with
+    the obstacle and outer boundaries marked
+    """
+    n_angular = max(12, int(numpy.ceil(2*numpy.pi*r_outer/h)))
+    n_radial = max(2, int(numpy.ceil((r_outer-r_inner)/h)))
+    points, cells = annulus_points_cells(center, r_inner, r_outer, n_radial,
+                                         n_angular, aspect, angle)
+    mesh = mesh_from_arrays(points, cells)
+    mesh.init(1, 0)
+    mesh.init(2, 1)
+    facets = mesh.topology()(1, 0)().reshape(-1, 2)
+    # Boundary facets belong to a single cell
+    cell_facets = mesh.topology()(2, 1)()
+    boundary = numpy.bincount(cell_facets, minlength=len(facets)) == 1
+    mf = MeshFunction("size_t", mesh, 1, 0)
+    markers = mf.array()
+    on_obstacle = numpy.all(facets < n_angular, axis=1)
+    markers[boundary & on_obstacle] = obstacle
+    markers[boundary & ~on_obstacle] = outer
+    mf.set_values(markers)
+    return mesh, mf
+
+def background_mesh(n):
+    """ Unit square mesh with n cells in each direction, and its markers """
+    mesh = UnitSquareMesh(n, n)
+    mf = MeshFunction("size_t", mesh, 1, 0)
+    CompiledSubDomain("on_boundary && (near(x[1], 0) || near(x[1], 1))"
+                      ).mark(mf, walls)
+    CompiledSubDomain("on_boundary && near(x[0], 0)").mark(mf, inflow)
+    CompiledSubDomain("on_boundary && near(x[0], 1)").mark(mf, outflow)
+    return mesh, mf
+
+def part_layout(num_parts):
+    """
+    Centers, radii, aspect ratios and rotations of num_parts annuli,
+    placed on a regular grid in the unit square without overlapping
+    """
+    grid = int(numpy.ceil(numpy.sqrt(num_parts)))
+    spacing = 1./grid
+    layout = []
+    for p in range(num_parts):
+        i, j = p % grid, p // grid
+        layout.append({"center": ((i+0.5)*spacing, (j+0.5)*spacing),
+                       "r_inner": 0.15*spacing, "r_outer": 0.4*spacing,
+                       "aspect": 0.6, "angle": numpy.pi*p/max(num_parts, 1)})
+    return layout
+
+def synthetic_multimesh(num_parts, resolution):
+    """
+    Build and cover a multimesh of a unit square with num_parts annuli.
+    Arguments:
+        num_parts  - Number of annulus parts on top of the background
+        resolution - Number of background cells in each direction, the
+                     annuli have the same cell size
+    Returns the multimesh, the facet function of each part and the layout
+    of the annuli. The cover points are the centers of the annuli.
+    """
+    h = 1./resolution
+    mesh, mf = background_mesh(resolution)
+    meshes, mfs = [mesh], [mf]
+    layout = part_layout(num_parts)
+    for part in layout:
+        mesh_i, mf_i = annulus_mesh(part["center"], part["r_inner"],
+                                    part["r_outer"], h, part["aspect"],
+                                    part["angle"])
+        meshes.append(mesh_i)
+        mfs.append(mf_i)
+    multimesh = MultiMesh()
+    for mesh in meshes:
+        multimesh.add(mesh)
+    multimesh.build()
+    for part in layout:
+        multimesh.auto_cover(0, Point(*part["center"]))
+    return multimesh, mfs, layout
@@ -0,0 +1,56 @@
+import numpy
+
+class ActiveDofMask():
+    """
+    Boolean mask of the active dofs of a MultiMeshFunctionSpace, for
+    postprocessing of MultiMeshFunctions without the inactive dofs.
+    The mask is computed once after each multimesh build, detected by a
+    change of the coordinates of the parts. If the multimesh is covered
+    without moving any part, call update.
+    """
+    def __init__(self, V):
+        self.V = V
+        self.multimesh = V.multimesh()
+        self.mask = None
+        self.key = None
+
+    def __coordinates_key(self):
+        return tuple(hash(self.multimesh.part(i).coordinates().tobytes())
+                     for i in range(self.multimesh.num_parts()))
+
+    def update(self):
+        """ Recompute the mask for the current multimesh """
+        inactive = numpy.zeros(self.V.dim(), dtype=bool)
+        dofmap = self.V.dofmap()
+        for i in range(self.multimesh.num_parts()):
+            inactive[numpy.asarray(dofmap.inactive_dofs(self.multimesh, i),
+                                   dtype=int)] = True
+        self.mask = numpy.logical_not(inactive)
+        self.key = self.__coordinates_key()
+
+    def active(self):
+        """ The boolean mask, True at active dofs """
+        if self.mask is None or self.key != self.__coordinates_key():
+            self.update()
+        return self.mask
+
+    def active_values(self, f):
+        """ Values of the MultiMeshFunction f at the active dofs """
+        return f.vector().get_local()[self.active()]
+
+    def min(self, f):
+        return numpy.min(self.active_values(f))
+
+    def max(self, f):
+        return numpy.max(self.active_values(f))
+
+    def nan_masked(self, f):
+        """ Values of f with NaN at the inactive dofs """
+        values = f.vector().get_local()
+        values[numpy.logical_not(self.active())] = numpy.nan
+        return values
+
+    def set_nan(self, f):
+        """ Set the inactive dofs of f to NaN, such that they are hidden """
+        f.vector().set_local(self.nan_masked(f))
+        f.vector().apply("insert")
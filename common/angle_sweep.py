@@ -0,0 +1,70 @@
+"""
+Sweep of the functional and its gradient over a range of rotation angles.
+The angle range is split into contiguous chunks, which are solved by
+separate worker processes. Each worker solves the state and adjoint
+once per angle and writes the (deg, J, dJ) record of each angle to its
+own npz-file, which are merged when all workers are done.
+"""
+from multiprocessing import get_context, cpu_count
+import os
+import numpy
+
+def save_record(filename, **record):
+    """
+    Write a record to filename through a temporary file, such that a
+    crash never leaves a truncated record behind
+    """
+    tmp = filename + ".tmp"
+    with open(tmp, "wb") as outfile:
+        numpy.savez(outfile, **record)
+    os.replace(tmp, filename)
+
+def sweep_chunk(args):
+    """
+    Solve state and adjoint for each angle in a chunk, writing the record
+    of each angle to file as soon as it is computed
+    """
+    factory, angles, record_files = args
+    solver = factory()
+    for theta, record_file in zip(angles, record_files):
+        dJ = solver.eval_dJ(numpy.atleast_1d(theta))
+        save_record(record_file, deg=theta, J=solver.J, dJ=dJ)
+    return record_files
+
+def sweep(factory, angles, filename, processes=None):
+    """
+    Compute functional and gradient for all angles (in degrees).
+    Arguments:
+        factory   - Module level function returning a solver with
+                    eval_dJ(angles) setting solver.J
+        angles    - Angles to evaluate
+        filename  - npz-file the records (deg, J, dJ) are saved to
+        processes - Number of worker processes, defaults to all cores
+    Returns the merged records, sorted by angle.
+    """
+    if processes is None:
+        processes = cpu_count()
+    angles = numpy.asarray(angles, dtype=float)
+    base = os.path.splitext(filename)[0]
+    record_files = ["%s_%04d.npz" % (base, i) for i in range(len(angles))]
+    chunks = [chunk for chunk in numpy.array_split(numpy.arange(len(angles)),
+                                                   processes)
+              if len(chunk) > 0]
+    jobs = [(factory, angles[chunk], [record_files[i] for i in chunk])
+            for chunk in chunks]
+    # Spawn fresh interpreters, as forking an initialized dolfin is unsafe
+    with get_context("spawn").Pool(len(jobs)) as pool:
+        pool.map(sweep_chunk, jobs)
+
+    records = {"deg": [], "J": [], "dJ": []}
+    for record_file in record_files:
+        data = numpy.load(record_file)
+        for key in records.keys():
+            records[key].append(data[key])
+    records = {key: numpy.array(records[key]) for key in records}
+    order = numpy.argsort(records["deg"])
+    records = {key: records[key][order] for key in records}
+    numpy.savez(filename, **records)
+    for record_file in record_files:
+        os.remove(record_file)
+    return records
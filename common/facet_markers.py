@@ -0,0 +1,47 @@
+"""
+Facet markers of the parts of a multimesh, read from file once and kept
+in memory for the whole optimization. The mesh deformations move the
+vertices but keep the topology, so the markers of a part stay valid for
+every deformed copy of its mesh.
+"""
+from dolfin import MeshFunction, MeshValueCollection, XDMFFile, cpp
+
+class FacetMarkerStore():
+    def __init__(self, filename="meshes/mf_%d.xdmf"):
+        """
+        Arguments:
+            filename - Name of the facet function file of each part, with
+                       the part number as format argument
+        """
+        self.filename = filename
+        self.markers = {} # Marker array of each part
+        self.functions = {} # Facet function of each part, with mesh id
+
+    def __markers(self, i, mesh):
+        if i not in self.markers:
+            mvc = MeshValueCollection("size_t", mesh, 1)
+            with XDMFFile(self.filename % i) as infile:
+                infile.read(mvc, "name_to_read")
+            # The array is a view into the temporary MeshFunction, so it
+            # is copied before the function is freed
+            self.markers[i] = cpp.mesh.MeshFunctionSizet(
+                mesh, mvc).array().copy()
+        return self.markers[i]
+
+    def facet_function(self, i, mesh):
+        """
+        Facet function of part i on mesh. The same function is returned
+        as long as the mesh is the same, and a copy of the markers is
+        attached to a new mesh of the part, such as a line-search trial.
+        """
+        if i in self.functions and self.functions[i][0] == mesh.id():
+            return self.functions[i][1]
+        mf = MeshFunction("size_t", mesh, mesh.topology().dim()-1)
+        mf.set_values(self.__markers(i, mesh))
+        self.functions[i] = (mesh.id(), mf)
+        return mf
+
+    def load(self, multimesh):
+        """ Facet functions of all parts of the multimesh """
+        return [self.facet_function(i, multimesh.part(i))
+                for i in range(multimesh.num_parts())]
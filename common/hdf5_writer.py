@@ -0,0 +1,199 @@
+"""
+Time series output of functions on the parts of a multimesh to a single
+HDF5-file, with an XDMF-file describing it for ParaView.
+Vertex values of every part, and the coordinates of moving parts, are
+appended to chunked datasets, one entry per written step. The values are
+extracted from dolfin in the calling thread, while the HDF5 output runs in
+a background thread.
+"""
+import atexit
+import os
+import queue
+import threading
+import numpy
+
+class TimeSeriesWriter():
+    def __init__(self, filename, moving_parts=(), stride=1, threaded=True):
+        """
+        Arguments:
+            filename     - Name of the HDF5-file, the XDMF-file gets the
+                           same name with .xdmf extension
+            moving_parts - Parts whose coordinates changes between steps
+            stride       - Only every stride-th call to write is saved
+            threaded     - Write in a background thread
+        """
+        import h5py
+        self.h5py = h5py
+        self.filename = filename
+        self.moving_parts = set(moving_parts)
+        self.stride = stride
+        self.num_calls = 0
+        self.times = []
+        self.layout = None # Shape of each dataset entry
+        self.counts = {} # Number of entries of each dataset
+        self.topology = {}
+        self.h5 = None
+        self.closed = False
+        self.error = None # Exception raised in the background thread
+        # Bounded, such that a slow disk throttles the solver instead of
+        # filling the memory
+        self.queue = queue.Queue(maxsize=8) if threaded else None
+        if threaded:
+            self.thread = threading.Thread(target=self.__worker, daemon=True)
+            self.thread.start()
+        atexit.register(self.close)
+
+    def write(self, meshes, functions, t=None):
+        """
+        Append the functions to the time series.
+        Arguments:
+            meshes    - List with the mesh of each part
+            functions - Dictionary mapping a name to the list of the
+                        functions on each part
+            t         - Time of step, the number of the step if None
+        """
+        if self.closed:
+            raise RuntimeError("Writing to closed %s" % self.filename)
+        if self.error is not None:
+            raise self.error
+        self.num_calls += 1
+        if (self.num_calls - 1) % self.stride != 0:
+            return
+        step = len(self.times)
+        t = float(step if t is None else t)
+        self.times.append(t)
+        data = {}
+        for i, mesh in enumerate(meshes):
+            if i not in self.topology:
+                self.topology[i] = mesh.cells().copy()
+                data["Mesh/%d/topology" % i] = self.topology[i]
+            if step == 0 or i in self.moving_parts:
+                data["Mesh/%d/geometry" % i] = mesh.coordinates().copy()
+            for name, parts in functions.items():
+                data["Function/%s/%d" % (name, i)] = vertex_values(parts[i],
+                                                                   mesh)
+        if self.layout is None:
+            self.layout = {key: value.shape for key, value in data.items()}
+        for key in data.keys():
+            self.counts[key] = self.counts.get(key, 0) + 1
+        if self.queue is None:
+            self.__append(step, t, data)
+        else:
+            self.queue.put((step, t, data))
+
+    def __worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            try:
+                self.__append(*item)
+            except Exception as e:
+                # Keep consuming, such that write never blocks, and
+                # report the error at the next write
+                self.error = e
+
+    def __append(self, step, t, data):
+        if self.h5 is None:
+            dirname = os.path.dirname(self.filename)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+            self.h5 = self.h5py.File(self.filename, "w")
+            self.h5.create_dataset("time", shape=(0,), maxshape=(None,),
+                                   dtype=float, chunks=(1024,))
+        self.h5["time"].resize((step+1,))
+        self.h5["time"][step] = t
+        for key, value in data.items():
+            if key.endswith("topology"):
+                self.h5.create_dataset(key, data=value)
+                continue
+            if key not in self.h5:
+                self.h5.create_dataset(key, shape=(0,) + value.shape,
+                                       maxshape=(None,) + value.shape,
+                                       chunks=(1,) + value.shape,
+                                       dtype=value.dtype)
+            dataset = self.h5[key]
+            dataset.resize((dataset.shape[0]+1,) + value.shape)
+            dataset[-1] = value
+        self.h5.flush()
+
+    def close(self):
+        """
+        Finish all pending writes and write the XDMF-file. An error from
+        any of the writes is raised here, and the XDMF-file is not written
+        for an incomplete HDF5-file.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        if self.queue is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.queue = None
+        if self.h5 is not None:
+            self.h5.close()
+            self.h5 = None
+            if self.error is None:
+                self.__write_xdmf()
+        if self.error is not None:
+            raise self.error
+
+    def __write_xdmf(self):
+        h5_name = os.path.basename(self.filename)
+        def item(key, dims):
+            return ('<DataItem Dimensions="%s" Format="HDF">%s:/%s</DataItem>'
+                    % (" ".join(map(str, dims)), h5_name, key))
+        def slab(key, step, shape):
+            dims = " ".join(map(str, shape))
+            start = " ".join(["%d" % step] + ["0"]*len(shape))
+            count = " ".join(["1"] + [str(s) for s in shape])
+            return ('<DataItem ItemType="HyperSlab" Dimensions="%s">'
+                    '<DataItem Dimensions="3 %d" Format="XML">%s %s %s'
+                    '</DataItem>%s</DataItem>'
+                    % (dims, len(shape)+1, start, " ".join(["1"]*(len(shape)+1)),
+                       count, item(key, (self.counts[key],)+shape)))
+
+        lines = ['<?xml version="1.0"?>', '<Xdmf Version="3.0">', '<Domain>']
+        for i in sorted(self.topology.keys()):
+            cells = self.topology[i].shape
+            geometry = self.layout["Mesh/%d/geometry" % i]
+            lines.append('<Grid Name="part_%d" GridType="Collection" '
+                         'CollectionType="Temporal">' % i)
+            for step, t in enumerate(self.times):
+                lines.append('<Grid Name="part_%d_%d" GridType="Uniform">'
+                             % (i, step))
+                lines.append('<Time Value="%g"/>' % t)
+                lines.append('<Topology TopologyType="Triangle" '
+                             'NumberOfElements="%d">%s</Topology>'
+                             % (cells[0], item("Mesh/%d/topology" % i, cells)))
+                geometry_step = step if i in self.moving_parts else 0
+                lines.append('<Geometry GeometryType="XY">%s</Geometry>'
+                             % slab("Mesh/%d/geometry" % i, geometry_step,
+                                    geometry))
+                for key, shape in sorted(self.layout.items()):
+                    if not (key.startswith("Function/")
+                            and key.endswith("/%d" % i)):
+                        continue
+                    name = key.split("/")[1]
+                    kind = "Scalar" if shape[1] == 1 else "Vector"
+                    lines.append('<Attribute Name="%s" AttributeType="%s" '
+                                 'Center="Node">%s</Attribute>'
+                                 % (name, kind, slab(key, step, shape)))
+                lines.append('</Grid>')
+            lines.append('</Grid>')
+        lines += ['</Domain>', '</Xdmf>']
+        with open(os.path.splitext(self.filename)[0] + ".xdmf", "w") as xdmf:
+            xdmf.write("\n".join(lines))
+
+def vertex_values(function, mesh):
+    """
+    Values of function at the vertices of mesh, as an array with one row
+    per vertex. Two dimensional vectors are padded to three components,
+    as expected by ParaView.
+    """
+    values = function.compute_vertex_values(mesh)
+    value_size = max(1, int(numpy.prod(function.ufl_shape)))
+    values = values.reshape(value_size, -1).T
+    if value_size == 2:
+        values = numpy.hstack((values, numpy.zeros((len(values), 1))))
+    return values
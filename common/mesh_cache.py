@@ -0,0 +1,79 @@
+"""
+Content-addressed cache for generated meshes.
+A mesh is identified by the source of the whole module defining its
+generator, such that edits of helper functions and module constants are
+detected, the resolution, the geometry and marker parameters and a
+version string. The files written by the generator are stored under
+cache_dir/<hash>, and copied back instead of running gmsh when the same
+mesh is requested again.
+"""
+import hashlib
+import inspect
+import os
+import shutil
+import tempfile
+
+def cache_key(*parts):
+    """ Hash of the representation of all parts """
+    sha = hashlib.sha1()
+    for part in parts:
+        sha.update(repr(part).encode("utf-8"))
+    return sha.hexdigest()
+
+def geometry_key(function, res, params, version=""):
+    """ Key of the mesh generated by function(res) with given parameters """
+    return cache_key(inspect.getsource(inspect.getmodule(function)),
+                     function.__name__, float(res), sorted(params.items()),
+                     version)
+
+def restore(key, outputs, cache_dir="meshes/cache"):
+    """
+    Copy the cached files of key to the output paths.
+    Returns False if there is no complete entry for key.
+    """
+    entry = os.path.join(cache_dir, key)
+    cached = [os.path.join(entry, os.path.basename(output))
+              for output in outputs]
+    if not all(os.path.isfile(path) for path in cached):
+        return False
+    for path, output in zip(cached, outputs):
+        shutil.copyfile(path, output)
+    return True
+
+def store(key, outputs, cache_dir="meshes/cache"):
+    """
+    Store the output files as the entry of key. The entry is written to a
+    temporary directory first, so an interrupted run never leaves a
+    partial entry.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    entry = os.path.join(cache_dir, key)
+    if os.path.isdir(entry):
+        shutil.rmtree(entry)
+    tmp = tempfile.mkdtemp(dir=cache_dir)
+    for output in outputs:
+        shutil.copyfile(output, os.path.join(tmp, os.path.basename(output)))
+    os.rename(tmp, entry)
+
+def cached_mesh(function, res, outputs, params, cache_dir="meshes/cache",
+                version=""):
+    """
+    Call function(res), which writes the files in outputs, unless the
+    mesh is already in the cache.
+    Arguments:
+        function  - Mesh generator taking the resolution as argument
+        res       - Resolution of the mesh
+        outputs   - Paths of all files written by the generator
+        params    - Dictionary of module level geometry parameters and
+                    markers the generator depends on
+        cache_dir - Directory of the cache
+        version   - Salt of the key, change it to invalidate entries made
+                    with code outside the generator module, such as an
+                    updated gmsh
+    """
+    key = geometry_key(function, res, params, version)
+    if restore(key, outputs, cache_dir):
+        print("Loaded %s(%s) from mesh cache" % (function.__name__, res))
+        return
+    function(res)
+    store(key, outputs, cache_dir)
@@ -0,0 +1,54 @@
+"""
+Splitting of a mixed velocity-pressure MultiMeshFunction into separate
+velocity and pressure MultiMeshFunctions by a precomputed gather of the
+dof values, instead of interpolation on every part after each solve.
+"""
+import numpy
+
+class MixedSplitter():
+    def __init__(self, VQ, V, Q):
+        """
+        Precompute, for each dof of V and Q, the corresponding dof of the
+        mixed space VQ. The gather only depends on the topology of the
+        parts, so it stays valid when the parts are moved or deformed.
+        Arguments:
+            VQ - Mixed MultiMeshFunctionSpace
+            V  - MultiMeshFunctionSpace of the first subspace of VQ
+            Q  - MultiMeshFunctionSpace of the second subspace of VQ
+        """
+        self.V = V
+        self.Q = Q
+        multimesh = VQ.multimesh()
+        u_index, p_index = [], []
+        offset = 0
+        for i in range(multimesh.num_parts()):
+            W_i = VQ.part(i)
+            num_cells = multimesh.part(i).num_cells()
+            u_index.append(offset + self.__gather(W_i.sub(0).dofmap(),
+                                                  V.part(i), num_cells))
+            p_index.append(offset + self.__gather(W_i.sub(1).dofmap(),
+                                                  Q.part(i), num_cells))
+            offset += W_i.dim()
+        # MultiMeshFunction vectors are the part vectors in order
+        self.u_index = numpy.concatenate(u_index)
+        self.p_index = numpy.concatenate(p_index)
+
+    @staticmethod
+    def __gather(sub_dofmap, V_i, num_cells):
+        """
+        Mixed space dof of each dof of V_i, matched cell by cell, as the
+        local dofs of a cell have the same order in both spaces
+        """
+        dofmap = V_i.dofmap()
+        index = numpy.empty(V_i.dim(), dtype=numpy.intc)
+        for cell in range(num_cells):
+            index[dofmap.cell_dofs(cell)] = sub_dofmap.cell_dofs(cell)
+        return index
+
+    def split(self, w, u, p):
+        """ Copy the values of the mixed function w into u and p """
+        values = w.vector().get_local()
+        u.vector().set_local(values[self.u_index])
+        u.vector().apply("insert")
+        p.vector().set_local(values[self.p_index])
+        p.vector().apply("insert")
@@ -0,0 +1,130 @@
+"""
+Timing of the phases of the solvers, such as multimesh build, assembly
+and solve, collected per optimization iteration.
+Each phase is timed both with a dolfin Timer, so it shows up in
+list_timings as "USER_TIMING: <phase>", and with perf_counter, which is
+accumulated per iteration and can be exported to JSON or CSV.
+"""
+from contextlib import contextmanager
+from time import perf_counter
+import csv
+import json
+import os
+from dolfin import Timer
+
+# Phases used by the solvers
+BUILD = "build"
+AUTO_COVER = "auto_cover"
+FORMS = "forms"
+ASSEMBLE = "assemble"
+BCS = "bcs"
+LOCK = "lock_inactive_dofs"
+FACTORIZE = "factorize"
+SOLVE = "solve"
+GRADIENT = "gradient"
+IO = "io"
+# Phases specific to some of the solvers
+UPDATE_MESH = "update_mesh"
+DEFORM = "deform"
+GEOMETRY = "geometry"
+CVT = "cvt"
+ELASTICITY_ASSEMBLE = "elasticity_" + ASSEMBLE
+ELASTICITY_SOLVE = "elasticity_" + SOLVE
+
+class Profiler():
+    def __init__(self):
+        self.iterations = [] # Finished iterations, phase -> [seconds, calls]
+        self.current = {}
+        self.enabled = True
+
+    @contextmanager
+    def phase(self, name):
+        """ Time the enclosed block as the given phase """
+        if not self.enabled:
+            yield
+            return
+        timer = Timer("USER_TIMING: %s" % name)
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+            timer.stop()
+            entry = self.current.setdefault(name, [0.0, 0])
+            entry[0] += elapsed
+            entry[1] += 1
+
+    def timed(self, name):
+        """ Decorator timing each call of a function as the given phase """
+        def decorator(function):
+            def wrapper(*args, **kwargs):
+                with self.phase(name):
+                    return function(*args, **kwargs)
+            wrapper.__name__ = function.__name__
+            wrapper.__doc__ = function.__doc__
+            return wrapper
+        return decorator
+
+    def next_iteration(self):
+        """ Close the current iteration, the following phases go to a new """
+        self.iterations.append(self.current)
+        self.current = {}
+
+    def records(self):
+        """ One record (iteration, phase, seconds, calls) per phase """
+        iterations = self.iterations
+        if len(self.current) > 0:
+            iterations = iterations + [self.current]
+        return [{"iteration": it, "phase": name, "seconds": seconds,
+                 "calls": calls}
+                for it, phases in enumerate(iterations)
+                for name, (seconds, calls) in sorted(phases.items())]
+
+    def totals(self):
+        """ Total seconds and calls of each phase over all iterations """
+        totals = {}
+        for record in self.records():
+            entry = totals.setdefault(record["phase"], [0.0, 0])
+            entry[0] += record["seconds"]
+            entry[1] += record["calls"]
+        return totals
+
+    def write_json(self, filename):
+        self.__makedirs(filename)
+        with open(filename, "w") as outfile:
+            json.dump({"records": self.records(),
+                       "totals": {name: {"seconds": seconds, "calls": calls}
+                                  for name, (seconds, calls)
+                                  in self.totals().items()}},
+                      outfile, indent=1)
+
+    def write_csv(self, filename):
+        self.__makedirs(filename)
+        with open(filename, "w", newline="") as outfile:
+            writer = csv.DictWriter(outfile, ["iteration", "phase",
+                                              "seconds", "calls"])
+            writer.writeheader()
+            writer.writerows(self.records())
+
+    def report(self):
+        """ Print the total time of each phase, largest first """
+        totals = self.totals()
+        total = sum(seconds for seconds, _ in totals.values())
+        print("%-20s %10s %8s %6s" % ("Phase", "Time [s]", "Calls", "%"))
+        for name, (seconds, calls) in sorted(totals.items(),
+                                             key=lambda item: -item[1][0]):
+            print("%-20s %10.3e %8d %6.1f" % (name, seconds, calls,
+                                              100*seconds/max(total, 1e-16)))
+
+    def reset(self):
+        self.iterations = []
+        self.current = {}
+
+    @staticmethod
+    def __makedirs(filename):
+        dirname = os.path.dirname(filename)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+# Shared by all solvers of a process, such that one report covers them all
+profiler = Profiler()
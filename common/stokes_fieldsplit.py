@@ -0,0 +1,92 @@
+"""
+GMRES for the locked multimesh Stokes system, preconditioned by an
+additive PETSc fieldsplit of the block diagonal matrix with the velocity
+operator and the pressure mass matrix, which approximates the Schur
+complement. The velocity split is solved with one AMG cycle and the
+pressure split with Jacobi.
+"""
+import numpy
+from dolfin import (PETScKrylovSolver, PETScOptions, assemble_multimesh,
+                    as_backend_type)
+
+class StokesFieldSplit():
+    def __init__(self, VQ, splitter, a_P, bcs, rtol=1e-10, max_it=1000,
+                 prefix="stokes_"):
+        """
+        Arguments:
+            VQ       - Mixed velocity-pressure MultiMeshFunctionSpace
+            splitter - MixedSplitter of VQ, giving the mixed dofs of the
+                       velocity and pressure
+            a_P      - Bilinear form of the block diagonal preconditioner
+            bcs      - Velocity boundary conditions of the system
+            rtol     - Relative tolerance of GMRES
+            max_it   - Maximal number of GMRES iterations
+            prefix   - PETSc options prefix of the solver
+        """
+        from petsc4py import PETSc
+        self.VQ = VQ
+        self.a_P = a_P
+        self.bcs = bcs
+        self.P = None
+        self.key = None # Coordinates the preconditioner was assembled at
+
+        for option, value in [("ksp_type", "gmres"),
+                              ("pc_type", "fieldsplit"),
+                              ("pc_fieldsplit_type", "additive"),
+                              ("fieldsplit_u_ksp_type", "preonly"),
+                              ("fieldsplit_u_pc_type", "hypre"),
+                              ("fieldsplit_u_pc_hypre_type", "boomeramg"),
+                              ("fieldsplit_p_ksp_type", "preonly"),
+                              ("fieldsplit_p_pc_type", "jacobi")]:
+            PETScOptions.set(prefix + option, value)
+        self.solver = PETScKrylovSolver()
+        self.solver.set_options_prefix(prefix)
+        self.solver.set_from_options()
+        self.solver.parameters["nonzero_initial_guess"] = True
+        self.solver.parameters["relative_tolerance"] = rtol
+        self.solver.parameters["maximum_iterations"] = max_it
+        # Index sets of the velocity and pressure dofs of the mixed vector.
+        # They only depend on the topology of the parts
+        pc = self.solver.ksp().getPC()
+        pc.setFieldSplitIS(
+            ("u", PETSc.IS().createGeneral(numpy.sort(splitter.u_index))),
+            ("p", PETSc.IS().createGeneral(numpy.sort(splitter.p_index))))
+
+    def __coordinates_key(self):
+        multimesh = self.VQ.multimesh()
+        return tuple(hash(multimesh.part(i).coordinates().tobytes())
+                     for i in range(multimesh.num_parts()))
+
+    def update_preconditioner(self, b):
+        """
+        Assemble the preconditioner matrix if the multimesh has moved
+        since the last assembly. Returns True if it was assembled.
+        Arguments:
+            b - Right hand side of the system, only used as work vector
+                for the boundary conditions and locking
+        """
+        key = self.__coordinates_key()
+        if key == self.key:
+            return False
+        # The cut cells, and thereby the sparsity pattern, change with the
+        # geometry, so a new matrix is assembled
+        P = assemble_multimesh(self.a_P)
+        b_P = b.copy()
+        [bc.apply(P, b_P) for bc in self.bcs]
+        self.VQ.lock_inactive_dofs(P, b_P)
+        self.P = P
+        self.key = key
+        return True
+
+    def set_operator(self, A, b):
+        """
+        Attach the locked system matrix A, with the preconditioner of the
+        current geometry
+        """
+        self.update_preconditioner(b)
+        self.solver.set_operators(as_backend_type(A),
+                                  as_backend_type(self.P))
+
+    def solve(self, x, b):
+        """ Solve for x, starting from its current values """
+        return self.solver.solve(x, b)
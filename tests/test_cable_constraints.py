@@ -0,0 +1,57 @@
+import os
+import sys
+import numpy
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "Poisson_MultiCable"))
+from cable_constraints import (CableConstraints, pair_distances,
+                               candidate_pairs)
+
+def reference_g(positions, max_radius, min_distance):
+    """ Constraints in the order of the original sympy implementation """
+    xy = positions.reshape(-1, 2)
+    n = len(xy)
+    g = [xy[i,0]**2 + xy[i,1]**2 - max_radius[i]**2 for i in range(n)]
+    for i in range(n):
+        for j in range(i+1, n):
+            g.append(min_distance[i,j]**2 - numpy.sum((xy[i]-xy[j])**2))
+    return numpy.array(g)
+
+def test_constraints_and_sparse_jacobian():
+    numpy.random.seed(1)
+    n = 5
+    inner_radius = 0.3*numpy.linspace(0.8, 1.2, n)
+    max_radius = 1.2 - inner_radius - 0.05
+    min_distance = pair_distances(inner_radius, 0.025)
+    constraints = CableConstraints(max_radius, min_distance)
+    x = numpy.random.rand(2*n)
+    assert(numpy.allclose(constraints.g(x),
+                          reference_g(x, max_radius, min_distance)))
+
+    rows, cols = constraints.jac_structure()
+    assert(len(rows) == constraints.num_nonzeros == 2*n + 4*n*(n-1)//2)
+    # Compare with central finite differences
+    eps = 1e-6
+    jac_fd = numpy.zeros((constraints.num_constraints, 2*n))
+    for k in range(2*n):
+        dx = numpy.zeros(2*n)
+        dx[k] = eps
+        jac_fd[:,k] = (constraints.g(x+dx) - constraints.g(x-dx))/(2*eps)
+    assert(numpy.allclose(constraints.dense_jac(x), jac_fd, atol=1e-6))
+    assert(numpy.allclose(constraints.jac(x), jac_fd[rows, cols], atol=1e-6))
+
+def test_candidate_pairs_match_brute_force():
+    numpy.random.seed(2)
+    n = 40
+    inner_radius = 0.05*numpy.ones(n)
+    min_distance = pair_distances(inner_radius, 0.025)
+    x = 2*numpy.random.rand(2*n) - 1
+    margin = 0.05
+    xy = x.reshape(-1, 2)
+    expected = [(i, j) for i in range(n) for j in range(i+1, n)
+                if numpy.linalg.norm(xy[i]-xy[j]) < min_distance[i,j]+margin]
+    pairs = candidate_pairs(x, min_distance, margin)
+    assert(list(map(tuple, pairs)) == expected)
+
+    constraints = CableConstraints(1-inner_radius, min_distance, pairs)
+    assert(constraints.num_constraints == n + len(expected))
+    assert(constraints.num_nonzeros == 2*n + 4*len(expected))
@@ -0,0 +1,28 @@
+import os
+import sys
+import numpy
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "Poisson_MultiCable"))
+from cable_constraints import CableConstraints, pair_distances
+from multistart import feasible_layouts, dominated
+
+def test_feasible_layouts():
+    # Five cable configuration of five_cables.py
+    inner_radius = 0.3*numpy.array([1, 0.75, 0.9, 1, 0.8])
+    max_radius = 1.2 - inner_radius - 0.05
+    min_distance = pair_distances(inner_radius, 0.025)
+    layouts = feasible_layouts(max_radius, min_distance, 20, slack=1e-3)
+    assert layouts.shape == (20, 10)
+    assert numpy.allclose(layouts[:, 0], 0)
+    constraints = CableConstraints(max_radius, min_distance)
+    for layout in layouts:
+        assert numpy.all(constraints.g(layout) <= -1e-3)
+    assert len(numpy.unique(layouts, axis=0)) == 20
+
+def test_dominated():
+    stalled = [2.0, 1.5, 1.2, 1.1, 1.1, 1.1, 1.1]
+    assert dominated(stalled, 1.0, 3, 1e-3)
+    assert not dominated(stalled, 1.2, 3, 1e-3)
+    assert not dominated(stalled, 1.0, 10, 1e-3)
+    decreasing = [2.0, 1.8, 1.6, 1.4, 1.2]
+    assert not dominated(decreasing, 1.0, 3, 1e-3)
@@ -0,0 +1,30 @@
+import os
+import sys
+import numpy
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "..", "Stokes_Pironneau"))
+from polygon import orient_edges, polygon_quantities
+
+def circle_edges(n, center=(0.3, 0.6), radius=0.2, seed=0):
+    """ Shuffled, arbitrarily oriented edges of a regular n-gon """
+    theta = numpy.linspace(0, 2*numpy.pi, n, endpoint=False)
+    coordinates = numpy.array(center) + radius*numpy.array([numpy.cos(theta),
+                                                            numpy.sin(theta)]).T
+    edges = numpy.array([[i, (i+1) % n] for i in range(n)])
+    rng = numpy.random.RandomState(seed)
+    flip = rng.rand(n) < 0.5
+    edges[flip] = edges[flip][:, ::-1]
+    edges = edges[rng.permutation(n)]
+    # A point outside the obstacle next to each edge, as opposite vertex
+    mid = numpy.mean(coordinates[edges], axis=1)
+    outside = numpy.array(center) + 1.5*(mid - numpy.array(center))
+    return numpy.vstack((coordinates, outside)), edges, n + numpy.arange(n)
+
+def test_regular_polygon():
+    n = 40
+    coordinates, edges, opposite = circle_edges(n)
+    edges = orient_edges(coordinates, edges, opposite)
+    area, cx, cy = polygon_quantities(coordinates, edges)
+    exact = 0.5*n*0.2**2*numpy.sin(2*numpy.pi/n)
+    assert numpy.isclose(area, exact)
+    assert numpy.allclose([cx, cy], [0.3, 0.6])